@@ -0,0 +1,60 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+# Ограниченный пул потоков для запросов к SQLite: каждый поток держит своё
+# соединение (см. database.get_connection), поэтому размер пула = число соединений
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+async def run_db(func, *args, **kwargs):
+    """
+    Выполняет синхронную функцию работы с БД в пуле потоков,
+    не блокируя цикл событий aiogram.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def _to_async(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+def shutdown():
+    """
+    Останавливает пул потоков БД (вызывается при завершении приложения).
+    """
+    _executor.shutdown(wait=True)
+
+# Асинхронные аналоги функций database.py
+init_db = _to_async(database.init_db)
+add_shelter = _to_async(database.add_shelter)
+get_filtered_shelters = _to_async(database.get_filtered_shelters)
+search_shelters = _to_async(database.search_shelters)
+get_shelters_for_city = _to_async(database.get_shelters_for_city)
+get_shelters_page = _to_async(database.get_shelters_page)
+get_shelter_by_id = _to_async(database.get_shelter_by_id)
+get_shelter_card = _to_async(database.get_shelter_card)
+add_favorite = _to_async(database.add_favorite)
+get_user_favorites = _to_async(database.get_user_favorites)
+get_recent_posts_for_group = _to_async(database.get_recent_posts_for_group)
+get_favorite_group_ids = _to_async(database.get_favorite_group_ids)
+post_already_saved = _to_async(database.post_already_saved)
+save_favorite_post = _to_async(database.save_favorite_post)
+get_latest_favorite_posts = _to_async(database.get_latest_favorite_posts)
+get_state = _to_async(database.get_state)
+set_state = _to_async(database.set_state)
+increment_state = _to_async(database.increment_state)
+get_max_favorite_post_row = _to_async(database.get_max_favorite_post_row)
+get_pending_notifications = _to_async(database.get_pending_notifications)
+set_notification_cursor = _to_async(database.set_notification_cursor)
+acquire_lease = _to_async(database.acquire_lease)
+release_lease = _to_async(database.release_lease)
+get_lease = _to_async(database.get_lease)
+claim_update = _to_async(database.claim_update)
+unclaim_update = _to_async(database.unclaim_update)
+expire_processed_updates = _to_async(database.expire_processed_updates)
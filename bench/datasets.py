@@ -0,0 +1,90 @@
+import os
+import random
+import time
+from datetime import datetime
+
+import database
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+SIZES = (10_000, 100_000, 1_000_000)
+MAIN_CITY = "Новосибирск"
+CITIES = [MAIN_CITY, "Москва", "Томск", "Омск", "Барнаул", "Кемерово", "Красноярск", "Иркутск"]
+WORDS = (
+    "приют кошки собаки корм лекарства волонтёры помощь животным передержка стерилизация "
+    "пристройство щенки котята ветеринар сбор средств поводки миски наполнитель дом семья"
+).split()
+USERS = 1000
+FAVORITES_PER_USER = 5
+BATCH = 5000
+SIZE_KEY = "bench_dataset"
+
+def dataset_path(size: int, seed: int) -> str:
+    return os.path.join(DATA_DIR, f"shelters_{size}_{seed}.db")
+
+def _rows(rng: random.Random, size: int, now: int):
+    for i in range(size):
+        owner_id = -(i // 10 + 1)
+        # Половина приютов — в основном городе, остальные равномерно по другим
+        city = MAIN_CITY if rng.random() < 0.5 else rng.choice(CITIES[1:])
+        text = f"{city}. " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 60)))
+        date = datetime.fromtimestamp(now - rng.randint(0, 365 * 86400)).strftime("%Y-%m-%d %H:%M:%S")
+        post_id = i + 1
+        yield (f"{owner_id}_{post_id}", f"Группа {owner_id}", f"https://vk.com/wall{owner_id}_{post_id}", city, text, date)
+
+def build_dataset(size: int, seed: int = 42) -> str:
+    """
+    Создаёт (или переиспользует) базу с size приютами, избранным и постами групп.
+    Данные детерминированы seed, поэтому прогоны на разных коммитах сравнимы.
+    Возвращает путь к файлу базы.
+    """
+    path = dataset_path(size, seed)
+    database.DB_PATH = path
+    database.close_connection()
+    if os.path.exists(path):
+        database.init_db()
+        if database.get_state(SIZE_KEY) == str(size):
+            return path
+        # Недостроенный набор (прерванный прогон) создаём заново
+        database.close_connection()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    started = time.perf_counter()
+    database.init_db()
+    rng = random.Random(seed)
+    now = int(time.time())
+    batch = []
+    for row in _rows(rng, size, now):
+        batch.append(row)
+        if len(batch) >= BATCH:
+            database.add_shelters(batch)
+            batch = []
+    if batch:
+        database.add_shelters(batch)
+
+    conn = database.get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO favorites (user_id, post_url, group_id) VALUES (?, ?, ?)",
+            [
+                (user_id, f"https://vk.com/wall{shelter_id}", shelter_id)
+                for user_id in range(1, USERS + 1)
+                for shelter_id in (
+                    f"-{owner}_{owner * 10}" for owner in
+                    (rng.randint(1, max(1, size // 10)) for _ in range(FAVORITES_PER_USER))
+                )
+            ],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO favorite_posts (group_id, post_url, text) VALUES (?, ?, ?)",
+            [
+                (group_id, f"https://vk.com/wall{group_id.rsplit('_', 1)[0]}_{1000 + i}", "Новый пост")
+                for i, (group_id,) in enumerate(conn.execute("SELECT DISTINCT group_id FROM favorites").fetchall())
+            ],
+        )
+    database.set_state(SIZE_KEY, str(size))
+    conn.execute("ANALYZE")
+    print(f"Набор данных {size}: {path} ({time.perf_counter() - started:.1f} с)")
+    return path
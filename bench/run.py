@@ -0,0 +1,357 @@
+"""
+Воспроизводимый бенчмарк парсера, базы данных и webhook без обращения к VK и Telegram.
+VK API и Bot API заменяются локальными заглушками (bench/stubs.py), базы с
+10k/100k/1M приютов генерируются по seed (bench/datasets.py) и переиспользуются.
+
+    python -m bench.run
+    python -m bench.run --sizes 10000 --only db,webhook --out results.json
+
+Результат — JSON в bench/results/: posts/sec парсера, p50/p99 функций database.py
+по размерам набора, updates/sec и задержки обработки webhook.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from bench import datasets
+from bench.stubs import TelegramStub, VKStub
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+PHASES = ("db", "parser", "webhook")
+BENCH_TOKEN = "123456:bench"
+
+def percentiles(samples) -> dict:
+    """
+    Сводка по задержкам в секундах: n, p50, p99, среднее и максимум в миллисекундах.
+    """
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+    def pick(p):
+        return ordered[min(len(ordered) - 1, max(0, int(len(ordered) * p / 100 + 0.5) - 1))] * 1000
+    return {
+        "n": len(ordered),
+        "p50_ms": round(pick(50), 3),
+        "p99_ms": round(pick(99), 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+def timed(func, iterations: int) -> list:
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def shelter_id(i: int) -> str:
+    # Тот же формат id, что и в datasets._rows
+    return f"{-(i // 10 + 1)}_{i + 1}"
+
+def bench_db(size: int, seed: int, iterations: int) -> dict:
+    """
+    p50/p99 основных функций database.py на наборе из size приютов.
+    """
+    import database
+
+    datasets.build_dataset(size, seed)
+    conn = database.get_connection()
+    rng = random.Random(seed)
+    city = datasets.MAIN_CITY
+    ids = [shelter_id(rng.randrange(size)) for _ in range(iterations)]
+    words = [rng.choice(datasets.WORDS) for _ in range(iterations)]
+    users = [rng.randint(1, datasets.USERS) for _ in range(iterations)]
+    groups = [row[0] for row in conn.execute("SELECT DISTINCT group_id FROM favorites LIMIT ?", (iterations,))]
+    deep = conn.execute(
+        "SELECT post_ts, id FROM shelters WHERE city = ? ORDER BY post_ts DESC, id DESC LIMIT 1 OFFSET ?",
+        (city, size // 4),
+    ).fetchone()
+    now = int(time.time())
+    writes = [
+        (f"bench_{i}", "Группа bench", f"https://vk.com/wallbench_{i}", city, "приют корм", "2024-01-01 00:00:00")
+        for i in range(50)
+    ]
+
+    cases = {
+        "get_shelters_for_city": lambda i: database.get_shelters_for_city(city),
+        "get_shelters_page": lambda i: database.get_shelters_page(city),
+        "get_shelters_page[deep]": lambda i: database.get_shelters_page(city, deep),
+        "get_shelter_by_id": lambda i: database.get_shelter_by_id(ids[i]),
+        "get_shelter_card": lambda i: database.get_shelter_card(ids[i]),
+        "search_shelters": lambda i: database.search_shelters(words[i], city),
+        "get_filtered_shelters": lambda i: database.get_filtered_shelters(city, words[i]),
+        "get_user_favorites": lambda i: database.get_user_favorites(users[i]),
+        "get_recent_posts_for_group": lambda i: database.get_recent_posts_for_group(groups[i % len(groups)]),
+        "get_favorite_group_ids": lambda i: database.get_favorite_group_ids(),
+        "post_already_saved": lambda i: database.post_already_saved(f"https://vk.com/wall{ids[i]}"),
+        "get_latest_favorite_posts": lambda i: database.get_latest_favorite_posts(),
+        "get_group_watermarks": lambda i: database.get_group_watermarks(),
+        "get_pending_notifications": lambda i: database.get_pending_notifications(0),
+        "get_session": lambda i: database.get_session(users[i], now - 3600),
+        "update_session": lambda i: database.update_session(users[i], {"city": city}, now),
+        "get_city_last_run": lambda i: database.get_city_last_run(city),
+        "add_shelters[50]": lambda i: database.add_shelters(writes),
+    }
+    result = {}
+    for name, func in cases.items():
+        func(0)  # прогрев кэша страниц и подготовленных выражений
+        result[name] = percentiles(timed(func, iterations))
+        print(f"  {size:>8} {name:<28} p50={result[name]['p50_ms']:.3f} мс p99={result[name]['p99_ms']:.3f} мс")
+    database.close_connection()
+    return result
+
+def bench_parser(seed: int, pages: int) -> dict:
+    """
+    posts/sec vk_parser.search_vk_groups на синтетической выдаче newsfeed.search:
+    холодный прогон (все посты новые) и повторный (все посты уже обработаны).
+    """
+    import database
+    import vk_api
+    import vk_parser
+
+    stub = VKStub(datasets.MAIN_CITY, seed=seed, pages=pages).start()
+    vk_api.VK_API_URL = stub.url + "/method/"
+    result = {"pages_per_query": pages}
+    try:
+        for run in ("cold", "warm"):
+            if run == "warm":
+                # Повторный прогон с тем же окном времени: проверяется только отсев уже виденных постов
+                with database.get_connection() as conn:
+                    conn.execute("DELETE FROM city_runs")
+            served = stub.items_served
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                vk_parser.search_vk_groups(datasets.MAIN_CITY)
+            elapsed = time.perf_counter() - started
+            posts = stub.items_served - served
+            result[run] = {
+                "posts": posts,
+                "seconds": round(elapsed, 3),
+                "posts_per_sec": round(posts / elapsed, 1) if elapsed else None,
+            }
+            print(f"  parser {run}: {posts} постов за {elapsed:.2f} с ({result[run]['posts_per_sec']} постов/с)")
+        result["vk_requests"] = stub.requests
+        result["shelters"] = database.get_connection().execute("SELECT COUNT(*) FROM shelters").fetchone()[0]
+    finally:
+        stub.stop()
+    return result
+
+def make_updates(count: int, seed: int, size: int) -> list:
+    """
+    Синтетические обновления Telegram: каждый пользователь проходит сценарий
+    /start -> город -> карточка приюта -> назад к приютам -> сохранённые.
+    """
+    rng = random.Random(seed)
+    scenario = ["/start", f"city_{datasets.MAIN_CITY}", None, f"back_shelters|{datasets.MAIN_CITY}", "fav_menu"]
+    updates = []
+    now = int(time.time())
+    for update_id in range(1, count + 1):
+        user_id = rng.randint(1, datasets.USERS)
+        action = scenario[update_id % len(scenario)] or f"info_{shelter_id(rng.randrange(size))}"
+        user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+        chat = {"id": user_id, "type": "private"}
+        if action.startswith("/"):
+            update = {"update_id": update_id, "message": {
+                "message_id": update_id, "date": now, "chat": chat, "from": user, "text": action,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(action)}],
+            }}
+        else:
+            update = {"update_id": update_id, "callback_query": {
+                "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": action,
+                "message": {"message_id": update_id, "date": now, "chat": chat, "text": "..."},
+            }}
+        updates.append((update_kind(action), update))
+    return updates
+
+def update_kind(action: str) -> str:
+    """
+    Группа для задержек по типам: команда, либо префикс callback_data (city_, info_, back_shelters, ...).
+    """
+    for prefix in ("city_", "info_"):
+        if action.startswith(prefix):
+            return prefix
+    return action.split("|")[0].split(" ")[0]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def bench_webhook(size: int, seed: int, count: int, concurrency: int) -> dict:
+    """
+    updates/sec и задержки пути main.telegram_webhook -> UpdateQueue -> обработчик aiogram
+    через настоящий HTTP-сервер (uvicorn) и заглушку Bot API.
+    """
+    import aiohttp
+    import uvicorn
+    import vk_api
+
+    tg = TelegramStub().start()
+    vk = VKStub(datasets.MAIN_CITY, seed=seed).start()
+    os.environ["TELEGRAM_API_URL"] = tg.url
+    os.environ["VK_API_URL"] = vk_api.VK_API_URL = vk.url + "/method/"
+    datasets.build_dataset(size, seed)
+    import main
+    # Проверка стен избранного и рассылка идут фоном у лидера и искажали бы замер webhook
+    main.scheduler.favorites_hooks.clear()
+    main.scheduler.favorites_next_run = float("inf")
+
+    handled = {}
+    handler = main.update_queue.handler
+    async def timed_handler(update):
+        started = time.perf_counter()
+        try:
+            await handler(update)
+        finally:
+            handled[update.update_id] = (started, time.perf_counter())
+    main.update_queue.handler = timed_handler
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    updates = make_updates(count, seed, size)
+    sent = {}
+    acks = []
+    statuses = {}
+    url = f"http://127.0.0.1:{port}/webhook/{main.WEBHOOK_URL}"
+
+    async def send_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        async with aiohttp.ClientSession() as client:
+            async def send(update):
+                async with semaphore:
+                    started = time.perf_counter()
+                    sent[update["update_id"]] = started
+                    async with client.post(url, json=update) as response:
+                        await response.read()
+                        statuses[response.status] = statuses.get(response.status, 0) + 1
+                    acks.append(time.perf_counter() - started)
+            await asyncio.gather(*(send(update) for _, update in updates))
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(send_all())
+        sent_seconds = time.perf_counter() - started
+        deadline = time.time() + 120
+        while len(handled) < statuses.get(200, 0) and time.time() < deadline:
+            time.sleep(0.05)
+        server.should_exit = True
+        thread.join()
+    tg.stop()
+    vk.stop()
+
+    finished = max((end for _, end in handled.values()), default=started)
+    by_kind = {}
+    for kind, update in updates:
+        times = handled.get(update["update_id"])
+        if times:
+            by_kind.setdefault(kind, []).append(times[1] - times[0])
+    result = {
+        "updates": count,
+        "concurrency": concurrency,
+        "http_status": {str(code): n for code, n in statuses.items()},
+        "accepted_per_sec": round(count / sent_seconds, 1),
+        "updates_per_sec": round(len(handled) / (finished - started), 1) if handled else 0,
+        "ack_latency": percentiles(acks),
+        "end_to_end_latency": percentiles([handled[i][1] - sent[i] for i in handled if i in sent]),
+        "handler_latency": percentiles([end - begin for begin, end in handled.values()]),
+        "handler_latency_by_kind": {kind: percentiles(samples) for kind, samples in sorted(by_kind.items())},
+        "bot_api_calls": dict(tg.calls),
+    }
+    print(f"  webhook: {result['updates_per_sec']} обновлений/с, обработка p50={result['handler_latency'].get('p50_ms')} мс"
+          f" p99={result['handler_latency'].get('p99_ms')} мс")
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк парсера, БД и webhook на локальных заглушках")
+    parser.add_argument("--sizes", default=",".join(map(str, datasets.SIZES)),
+                        help="размеры наборов данных через запятую")
+    parser.add_argument("--only", default=",".join(PHASES), help="какие части запускать: db,parser,webhook")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=200, help="повторов каждой функции БД")
+    parser.add_argument("--parser-pages", type=int, default=20, help="страниц newsfeed.search на запрос")
+    parser.add_argument("--updates", type=int, default=2000, help="обновлений для webhook")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных запросов к webhook")
+    parser.add_argument("--out", help="файл результатов (по умолчанию bench/results/<время>-<коммит>.json)")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    phases = [phase for phase in args.only.split(",") if phase]
+    workdir = tempfile.mkdtemp(prefix="bench-")
+
+    # Настройки окружения до импорта модулей бота: квоты и интервалы не должны
+    # ограничивать замер, файлы состояния — во временном каталоге
+    rules_path = os.path.join(workdir, "scoring_rules.json")
+    with open(rules_path, "w", encoding="utf-8") as f:
+        json.dump({"max_posts": 10 ** 9}, f)
+    os.environ.update({
+        "DB_PATH": os.path.join(workdir, "shelters.db"),
+        "VK_TOKEN": "bench",
+        "VK_RPS": "100000",
+        "VK_BATCH_WINDOW": "0.005",
+        "VK_MAX_PAGES_PER_QUERY": str(args.parser_pages),
+        "SCORING_RULES_FILE": rules_path,
+        "SEEN_POSTS_BLOOM_PATH": os.path.join(workdir, "seen_posts.bloom"),
+        "TELEGRAM_BOT_TOKEN": BENCH_TOKEN,
+        "WEBHOOK_URL": "bench",
+        "PARSER_INTERVAL": str(10 ** 9),
+        "FAVORITES_INTERVAL": str(10 ** 9),
+    })
+    os.environ.pop("RENDER_EXTERNAL_URL", None)
+
+    results = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "args": vars(args),
+    }
+    try:
+        if "db" in phases:
+            print("📊 База данных")
+            results["db"] = {str(size): bench_db(size, args.seed, args.iterations) for size in sizes}
+        if "parser" in phases:
+            print("📊 Парсер")
+            import database
+            database.DB_PATH = os.environ["DB_PATH"]
+            database.close_connection()
+            database.init_db()
+            results["parser"] = bench_parser(args.seed, args.parser_pages)
+        if "webhook" in phases:
+            print("📊 Webhook")
+            results["webhook"] = bench_webhook(min(sizes), args.seed, args.updates, args.concurrency)
+    finally:
+        results["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        out = args.out or os.path.join(
+            RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{results['commit'] or 'local'}.json"
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты: {out}")
+
+if __name__ == "__main__":
+    main()
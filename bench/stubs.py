@@ -0,0 +1,194 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Шаблоны текстов синтетических постов: примерно половина проходит оценку vk_parser
+POST_TEMPLATES = [
+    "{city}: приют для животных ищет помощь. Кошки и собаки в поисках дома!",
+    "Бездомные животные {city}. Спасение животных, нужна помощь животным.",
+    "{city}, приют. Срочно нужен корм и лекарства для собак.",
+    "Магазин в городе {city}: доставка и продажа кормов, реклама.",
+    "Продажа щенков, {city}. Доставка по городу.",
+    "Сегодня в городе {city} хорошая погода.",
+    "Кошки ищут дом, пишите в личные сообщения.",
+]
+CALL_PATTERN = re.compile(r"API\.([\w.]+)\(")
+
+class StubServer:
+    """
+    HTTP-сервер в отдельном потоке на свободном локальном порту.
+    """
+    def __init__(self, handler_cls):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self) -> dict:
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        if body:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params.update(json.loads(body))
+            else:
+                params.update({k: v[0] for k, v in parse_qs(body).items()})
+        return params
+
+    def _reply(self, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.do_POST()
+
+class VKStub(StubServer):
+    """
+    Заглушка VK API: синтетические, но воспроизводимые (seed) ответы
+    newsfeed.search и wall.get, а также execute из этих вызовов.
+    Считает отданные посты, чтобы бенчмарк мог посчитать posts/sec.
+    """
+    def __init__(self, city: str, seed: int = 42, pages: int = 3, latency: float = 0.0):
+        super().__init__(_VKHandler)
+        self.city = city
+        self.seed = seed
+        self.pages = pages
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.items_served = 0
+        self.requests = 0
+
+    def newsfeed_search(self, params: dict) -> dict:
+        count = int(params.get("count", 50))
+        page = int(params.get("start_from") or 0)
+        end_time = int(params.get("end_time") or time.time())
+        start_time = int(params.get("start_time") or end_time - 86400)
+        rng = random.Random(f"{self.seed}|{params.get('q')}|{params.get('latitude')}|{page}")
+        items = []
+        for i in range(count):
+            owner_id = -rng.randint(1, 100000)
+            items.append({
+                "post_id": rng.randint(1, 10 ** 6),
+                "source_id": owner_id,
+                "owner_id": owner_id,
+                "date": rng.randint(start_time, end_time),
+                "text": rng.choice(POST_TEMPLATES).format(city=self.city),
+            })
+        items.sort(key=lambda post: post["date"], reverse=True)
+        with self.lock:
+            self.items_served += len(items)
+        response = {"items": items, "count": count * self.pages}
+        if page + 1 < self.pages:
+            response["next_from"] = str(page + 1)
+        return response
+
+    def wall_get(self, params: dict) -> dict:
+        owner_id = int(params["owner_id"])
+        count = int(params.get("count", 20))
+        now = int(time.time())
+        # Каждую минуту на стене появляется новый пост
+        newest = now // 60
+        items = [
+            {"id": newest - i, "owner_id": owner_id, "date": now - i * 60,
+             "text": POST_TEMPLATES[(newest - i) % len(POST_TEMPLATES)].format(city=self.city)}
+            for i in range(count)
+        ]
+        return {"items": items, "count": count}
+
+    def call(self, method: str, params: dict):
+        if method == "newsfeed.search":
+            return self.newsfeed_search(params)
+        if method == "wall.get":
+            return self.wall_get(params)
+        return None
+
+    def execute(self, code: str) -> dict:
+        decoder = json.JSONDecoder()
+        results = []
+        for m in CALL_PATTERN.finditer(code):
+            params, _ = decoder.raw_decode(code, m.end())
+            results.append(self.call(m.group(1), params))
+        return {"response": results}
+
+class _VKHandler(_Handler):
+    def do_POST(self):
+        stub = self.server.stub
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        params = self._params()
+        with stub.lock:
+            stub.requests += 1
+        if stub.latency:
+            time.sleep(stub.latency)
+        if method == "execute":
+            self._reply(stub.execute(params.get("code", "")))
+            return
+        result = stub.call(method, params)
+        if result is None:
+            self._reply({"error": {"error_code": 3, "error_msg": f"Unknown method passed: {method}"}})
+        else:
+            self._reply({"response": result})
+
+class TelegramStub(StubServer):
+    """
+    Заглушка Bot API: принимает sendMessage/editMessageText и прочие методы,
+    отвечает корректными объектами Message и считает вызовы по методам.
+    """
+    def __init__(self, latency: float = 0.0):
+        super().__init__(_TelegramHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.message_id = 0
+
+    def handle(self, method: str, params: dict):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.message_id += 1
+            message_id = self.message_id
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id") or 0)
+            return {
+                "message_id": int(params.get("message_id") or message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        return True
+
+class _TelegramHandler(_Handler):
+    def do_POST(self):
+        stub = self.server.stub
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        if stub.latency:
+            time.sleep(stub.latency)
+        self._reply({"ok": True, "result": stub.handle(method, self._params())})
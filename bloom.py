@@ -0,0 +1,179 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Заголовок файла фильтра: сигнатура, число бит, число хэш-функций, время создания
+HEADER = struct.Struct("<4sQIQ")
+MAGIC = b"BLM1"
+# Пара (owner_id, post_id) упаковывается в 16 байт вместо строки "{owner_id}_{post_id}"
+PAIR = struct.Struct("<qq")
+HASHES = struct.Struct("<QQ")
+
+class BloomFilter:
+    """
+    Фильтр Блума фиксированного размера в бинарном файле, открытом через mmap.
+    Возможны ложноположительные ответы (с заданной вероятностью), ложноотрицательных нет.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, self.m, self.k, self.created_at = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path}: неизвестный формат фильтра")
+        self.identity = (os.fstat(self.file.fileno()).st_ino, self.created_at)
+
+    @classmethod
+    def create(cls, path: str, capacity: int, fp_rate: float) -> "BloomFilter":
+        # Оптимальные размеры: m = -n·ln(p) / ln(2)², k = m/n · ln(2)
+        m = max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        k = max(1, round(m / capacity * math.log(2)))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, m, k, int(time.time())))
+            f.truncate(HEADER.size + (m + 7) // 8)
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def _positions(self, owner_id: int, post_id: int):
+        digest = hashlib.blake2b(PAIR.pack(owner_id, post_id), digest_size=16).digest()
+        h1, h2 = HASHES.unpack(digest)
+        for i in range(self.k):
+            yield (h1 + i * h2) % self.m
+
+    def add(self, owner_id: int, post_id: int):
+        mm = self.mm
+        for pos in self._positions(owner_id, post_id):
+            idx = HEADER.size + (pos >> 3)
+            mm[idx] |= 1 << (pos & 7)
+
+    def contains(self, owner_id: int, post_id: int) -> bool:
+        mm = self.mm
+        for pos in self._positions(owner_id, post_id):
+            if not mm[HEADER.size + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+def file_identity(path: str):
+    """
+    (inode, время создания из заголовка) файла фильтра на диске или None, если файла нет.
+    По нему процесс замечает, что другой процесс ротировал фильтры.
+    """
+    try:
+        with open(path, "rb") as f:
+            inode = os.fstat(f.fileno()).st_ino
+            header = f.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    return inode, HEADER.unpack(header)[3]
+
+def parse_post_key(key: str):
+    # "-123_45" -> (-123, 45)
+    owner_id, post_id = key.rsplit("_", 1)
+    return int(owner_id), int(post_id)
+
+class BloomSeenPosts:
+    """
+    Вероятностная замена SeenPosts с фиксированным объёмом памяти.
+    Держит два фильтра — текущий и предыдущий — и ротирует их раз в window секунд,
+    так что отметки живут от одного до двух окон.
+    """
+    def __init__(self, path: str, capacity: int, fp_rate: float, window: int):
+        self.path = path
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.window = window
+        self.current = None
+        self.previous = None
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def _open_or_create(self, path):
+        if os.path.exists(path):
+            return BloomFilter(path)
+        return BloomFilter.create(path, self.capacity, self.fp_rate)
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.current = self._open_or_create(self.path + ".cur")
+            if os.path.exists(self.path + ".prev"):
+                self.previous = BloomFilter(self.path + ".prev")
+            self.loaded = True
+            self._rotate_if_needed()
+
+    def _reopen_if_rotated(self):
+        # Другой процесс ротировал фильтры: наши отображения указывают на старые файлы
+        if file_identity(self.path + ".cur") in (None, self.current.identity):
+            return
+        self.current.close()
+        if self.previous:
+            self.previous.close()
+        self.current = BloomFilter(self.path + ".cur")
+        self.previous = BloomFilter(self.path + ".prev") if os.path.exists(self.path + ".prev") else None
+        print(f"Фильтр обработанных постов {self.path} переоткрыт после ротации другим процессом")
+
+    def _rotate_if_needed(self):
+        self._reopen_if_rotated()
+        if time.time() - self.current.created_at < self.window:
+            return
+        self.current.flush()
+        if self.previous:
+            self.previous.close()
+        self.current.close()
+        os.replace(self.path + ".cur", self.path + ".prev")
+        self.previous = BloomFilter(self.path + ".prev")
+        self.current = BloomFilter.create(self.path + ".cur", self.capacity, self.fp_rate)
+        print(f"Фильтр обработанных постов {self.path} ротирован")
+
+    def __contains__(self, key):
+        if not self.loaded:
+            self.load()
+        owner_id, post_id = parse_post_key(key)
+        with self.lock:
+            if self.current.contains(owner_id, post_id):
+                return True
+            return bool(self.previous and self.previous.contains(owner_id, post_id))
+
+    def add(self, key):
+        if not self.loaded:
+            self.load()
+        owner_id, post_id = parse_post_key(key)
+        with self.lock:
+            self.current.add(owner_id, post_id)
+
+    def flush(self):
+        if not self.loaded:
+            return
+        with self.lock:
+            self.current.flush()
+
+    def sync(self):
+        # Фильтр отображён в файл (MAP_SHARED), поэтому отметки других процессов уже видны;
+        # после ротации другим процессом файлы нужно открыть заново
+        if not self.loaded:
+            self.load()
+        with self.lock:
+            self._reopen_if_rotated()
+
+    def expire(self):
+        if not self.loaded:
+            self.load()
+        with self.lock:
+            self._rotate_if_needed()
+        return 0
@@ -1,27 +1,81 @@
 from aiogram import Dispatcher, types, F
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command
-from database import (
-    init_db, get_shelters_for_city, add_favorite,
+from aiogram.filters import Command, CommandObject
+from async_db import (
+    get_shelters_page, add_favorite,
     get_user_favorites, get_recent_posts_for_group,
-    get_shelter_by_id, get_filtered_shelters
+    get_shelter_card, get_filtered_shelters, search_shelters
 )
+from formatting import NO_INFO, trim_to_sentence
+from singleflight import SingleFlight, NegativeCache
+from sessions import create_session_store
+from scheduler import scheduler
+from render_cache import render_cache
+from metrics import handler_seconds
 import asyncio
-import re
+import html
+import time
 from datetime import datetime
 from urllib.parse import quote
 
-# Инициализация базы данных (если база уже существует — данные не удаляются)
-init_db()
+# База данных инициализируется при старте приложения (main.lifespan), а не при импорте
 dp = Dispatcher()
 
+# Префиксы callback_data для метрики handler_seconds; остальные попадают в "other",
+# чтобы число меток не росло вместе с id приютов и городов
+CALLBACK_PREFIXES = ("city_", "info_", "fav|", "fav_menu", "back_shelters", "back_cities",
+                     "pg|", "search|", "recent_posts_")
+COMMANDS = ("/start", "/help", "/about", "/search", "/fav")
+
+def handler_label(update: types.Update) -> str:
+    if update.callback_query:
+        data = update.callback_query.data or ""
+        for prefix in CALLBACK_PREFIXES:
+            if data.startswith(prefix):
+                return prefix
+        return "other"
+    if update.message:
+        command = (update.message.text or "").split(" ", 1)[0].split("@", 1)[0]
+        return command if command in COMMANDS else "message"
+    return update.event_type
+
+@dp.update.outer_middleware()
+async def measure_handler(handler, update: types.Update, data: dict):
+    started = time.perf_counter()
+    try:
+        return await handler(update, data)
+    finally:
+        handler_seconds.observe(time.perf_counter() - started, handler_label(update))
+
 # Список предлагаемых городов (отображаются через inline-кнопки)
 CITIES = ["Новосибирск"]
-# Словарь для сохранения выбранного пользователем города: user_id -> city
-user_city: dict[int, str] = {}
-# Словарь для отслеживания последнего редактируемого сообщения для каждого пользователя,
-# чтобы обновлять его (и не засорять чат)
-user_last_msg: dict[int, types.Message] = {}
+# Сессии пользователей: выбранный город и последнее редактируемое сообщение
+# (chat_id, message_id), чтобы обновлять его и не засорять чат.
+# Хранилище ограничено по размеру и времени жизни, см. sessions.py
+sessions = create_session_store()
+
+async def remember_message(user_id: int, msg: types.Message):
+    await sessions.update(user_id, chat_id=msg.chat.id, message_id=msg.message_id)
+
+async def get_user_city(user_id: int) -> str:
+    return (await sessions.get(user_id)).get("city", "")
+
+# Поиск по городу по запросу пользователя: один на город одновременно,
+# города без результатов не ищутся повторно EMPTY_CITY_TTL секунд
+EMPTY_CITY_TTL = 15 * 60
+city_parses = SingleFlight()
+empty_cities = NegativeCache(EMPTY_CITY_TTL)
+
+def parse_city(city: str):
+    from leader import exclusive
+    from vk_parser import search_vk_groups
+    # Один разбор города на все воркеры: остальные дожидаются его окончания
+    with exclusive(f"parse:{city}") as owner:
+        if owner:
+            stats = search_vk_groups(city)
+            # Ошибки VK не прерывают поиск, но пустой результат тогда ничего не значит
+            if stats["source_failed"] or stats["errors"]:
+                raise RuntimeError(f"поиск по городу {city} завершился с ошибками")
 
 def build_city_keyboard() -> InlineKeyboardMarkup:
     buttons = [[InlineKeyboardButton(text=city, callback_data=f"city_{city}")] for city in CITIES]
@@ -45,7 +99,7 @@ async def start_handler(message: Message):
         "Привет! Выберите город, чтобы найти приюты, которым нужна помощь:",
         reply_markup=build_city_keyboard()
     )
-    user_last_msg[message.from_user.id] = sent
+    await remember_message(message.from_user.id, sent)
 
 @dp.message(Command("help"))
 async def help_handler(message: Message):
@@ -53,6 +107,7 @@ async def help_handler(message: Message):
         "👋 Я бот, помогающий волонтёрам находить приюты и посты с нуждами.\n\n"
         "📌 /start — начать работу, выбрать город\n"
         "⭐ /fav — ваши сохранённые посты\n"
+        "🔎 /search слово — поиск по приютам (например, /search корм)\n"
         "ℹ️ /about — узнать о проекте\n"
         "❓ /help — список команд"
     )
@@ -65,14 +120,71 @@ async def about_handler(message: Message):
         "Проект некоммерческий 💙"
     )
 
+SEARCH_PAGE_SIZE = 10
+
+def build_search_keyboard(results, offset: int) -> InlineKeyboardMarkup:
+    buttons = [
+        [InlineKeyboardButton(text=f"{name} ({city})", callback_data=f"info_{shelter_id}")]
+        for shelter_id, name, city in results[:SEARCH_PAGE_SIZE]
+    ]
+    # Кнопки листания передают только смещение: запрос хранится в сессии
+    # (callback_data ограничена 64 байтами, а запрос может быть любой длины)
+    nav = []
+    if offset > 0:
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"search|{max(offset - SEARCH_PAGE_SIZE, 0)}"))
+    if len(results) > SEARCH_PAGE_SIZE:
+        nav.append(InlineKeyboardButton(text="Ещё ➡️", callback_data=f"search|{offset + SEARCH_PAGE_SIZE}"))
+    if nav:
+        buttons.append(nav)
+    buttons.append([InlineKeyboardButton(text="🌆 Вернуться к городам", callback_data="back_cities")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+@dp.message(Command("search"))
+async def search_handler(message: Message, command: CommandObject):
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("Введите слова для поиска, например: /search корм")
+        return
+    # Запрашиваем на одну запись больше, чтобы понять, есть ли следующая страница
+    results = await search_shelters(query, limit=SEARCH_PAGE_SIZE + 1)
+    if not results:
+        await message.answer(f"По запросу «{query}» ничего не найдено.")
+        return
+    await sessions.update(message.from_user.id, search_query=query)
+    sent = await message.answer(
+        f"🔎 Результаты поиска «{query}»:",
+        reply_markup=build_search_keyboard(results, 0)
+    )
+    await remember_message(message.from_user.id, sent)
+
+@dp.callback_query(lambda c: c.data.startswith("search|"))
+async def search_page(callback: types.CallbackQuery):
+    # callback.data = "search|{offset}", запрос берётся из сессии пользователя
+    # (в кнопках старых сообщений — "search|{offset}|{query}")
+    parts = callback.data.split("|", 2)
+    offset = int(parts[1])
+    query = parts[2] if len(parts) > 2 else (await sessions.get(callback.from_user.id)).get("search_query")
+    if not query:
+        await callback.answer("Поиск устарел, повторите /search", show_alert=True)
+        return
+    results = await search_shelters(query, limit=SEARCH_PAGE_SIZE + 1, offset=offset)
+    # update_message отправляет текст с parse_mode="HTML"
+    msg = await update_message(
+        callback.message,
+        f"🔎 Результаты поиска «{html.escape(query)}»:",
+        reply_markup=build_search_keyboard(results, offset)
+    )
+    await remember_message(callback.from_user.id, msg)
+    await callback.answer()
+
 # Обработка inline нажатий для выбора города
 @dp.callback_query(lambda c: c.data.startswith("city_"))
 async def process_city(callback: types.CallbackQuery):
     # callback.data = "city_{city}" (например, "city_Новосибирск")
     city = callback.data[5:]
-    user_city[callback.from_user.id] = city
+    await sessions.update(callback.from_user.id, city=city)
     msg = await update_message(callback.message, f"Ищем приюты в городе {city}, подождите немного...")
-    user_last_msg[callback.from_user.id] = msg
+    await remember_message(callback.from_user.id, msg)
     await show_shelters(msg, city)
     await callback.answer()
 
@@ -80,149 +192,149 @@ async def process_city(callback: types.CallbackQuery):
 async def choose_custom_city(callback: types.CallbackQuery):
     # Просим ввести город вручную
     msg = await update_message(callback.message, "Введите название города вручную:")
-    user_last_msg[callback.from_user.id] = msg
+    await remember_message(callback.from_user.id, msg)
     await callback.answer()
 
 # Обработка текстового ввода при выборе другого города
-@dp.message(lambda m: m.text and m.from_user.id not in user_city or (m.text not in CITIES))
+async def is_custom_city_input(m: Message) -> bool:
+    return bool(m.text and not await get_user_city(m.from_user.id) or (m.text not in CITIES))
+
+@dp.message(is_custom_city_input)
 async def handle_custom_city(message: Message):
     # Если пользователь ранее нажал "Другой город", то принимаем ввод
     city = message.text.strip()
-    user_city[message.from_user.id] = city
+    await sessions.update(message.from_user.id, city=city)
     sent = await message.answer(f"Ищем приюты в городе {city}, подождите немного...")
-    user_last_msg[message.from_user.id] = sent
+    await remember_message(message.from_user.id, sent)
     await show_shelters(sent, city)
 
-async def show_shelters(msg_obj, city: str):
-    # Получаем приюты для указанного города
-    shelters = get_shelters_for_city(city)
+SHELTERS_PAGE_SIZE = 10
+
+def build_shelters_keyboard(rows, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    # Формируем inline-кнопки для найденных приютов
+    buttons = [[InlineKeyboardButton(text=name, callback_data=f"info_{shelter_id}")] for shelter_id, name, _ in rows]
+    # Кнопки листания несут ключ (post_ts, id) первой/последней записи страницы
+    nav = []
+    if has_prev:
+        shelter_id, _, post_ts = rows[0]
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"pg|p|{post_ts}|{shelter_id}"))
+    if has_next:
+        shelter_id, _, post_ts = rows[-1]
+        nav.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"pg|n|{post_ts}|{shelter_id}"))
+    if nav:
+        buttons.append(nav)
+    buttons.append([InlineKeyboardButton(text="🌆 Вернуться к городам", callback_data="back_cities")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+async def load_shelters_keyboard(city: str, cursor=None, direction: str = "next"):
+    """
+    Возвращает клавиатуру страницы приютов (из кэша или из БД) либо None, если приютов нет.
+    Кэш сбрасывается, когда парсер сохраняет посты города.
+    """
+    key = ("city", city, cursor, direction)
+    keyboard = render_cache.get(key)
+    if keyboard is None:
+        rows, has_more = await get_shelters_page(city, cursor, direction, SHELTERS_PAGE_SIZE)
+        if not rows:
+            return None
+        if cursor is None:
+            has_prev, has_next = False, has_more
+        elif direction == "prev":
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = True, has_more
+        keyboard = build_shelters_keyboard(rows, has_prev, has_next)
+        render_cache.set(key, keyboard)
+    return keyboard
+
+async def show_shelters(msg_obj, city: str, cursor=None, direction: str = "next"):
+    scheduler.record_view(city)
+    keyboard = await load_shelters_keyboard(city, cursor, direction)
+
+    if keyboard is None and cursor is None:
+        if city in empty_cities:
+            await update_message(msg_obj, "Пока нет актуальной информации. Попробуйте позже.")
+            return
 
-    if not shelters:
         temp = await update_message(msg_obj, f"📭 Информации по городу {city} пока нет. Ищем свежие данные...")
-        user_last_msg[msg_obj.chat.id] = temp
+        await remember_message(msg_obj.chat.id, temp)
+        parsed = False
         try:
-            from vk_parser import search_vk_groups
-            await asyncio.to_thread(search_vk_groups, city)
+            # Все одновременные запросы по городу ждут один общий поиск
+            await city_parses.run(city, lambda: asyncio.to_thread(parse_city, city))
+            parsed = True
         except Exception as e:
             await msg_obj.answer("⚠️ Произошла ошибка при попытке собрать информацию.")
             print("Ошибка парсинга:", e)
 
-        # Повторяем проверку каждые 2 секунды (до 10 секунд)
-        for _ in range(5):
-            await asyncio.sleep(2)
-            shelters = get_shelters_for_city(city)
-            if shelters:
-                break
+        # Парсер сохраняет посты до завершения поиска, поэтому повторный опрос не нужен
+        keyboard = await load_shelters_keyboard(city)
+        # Город запоминается пустым, только если поиск прошёл без ошибок и ничего не нашёл
+        if keyboard is None and parsed:
+            empty_cities.add(city)
 
-        if not shelters:
-            await update_message(msg_obj, "Пока нет актуальной информации. Попробуйте позже.")
-            return
+    if keyboard is None:
+        await update_message(msg_obj, "Пока нет актуальной информации. Попробуйте позже.")
+        return
 
-    # Формируем inline-кнопки для найденных приютов
-    buttons = []
-    for shelter in shelters:
-        # Извлекаем: id, name, url, _, info, post_date
-        shelter_id, name, url, _, info, post_date = shelter
-        buttons.append([InlineKeyboardButton(text=name, callback_data=f"info_{shelter_id}")])
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    # Добавляем кнопку "Вернуться к городам" напрямую в inline_keyboard
-    keyboard.inline_keyboard.append([InlineKeyboardButton(text="🌆 Вернуться к городам", callback_data="back_cities")])
+    # Город с найденными приютами обновляется планировщиком по расписанию
+    scheduler.track(city)
     msg = await update_message(msg_obj, "📋 Вот список найденных приютов:", reply_markup=keyboard)
-    user_last_msg[msg.chat.id] = msg
+    await remember_message(msg.chat.id, msg)
+
+@dp.callback_query(lambda c: c.data.startswith("pg|"))
+async def shelters_page(callback: types.CallbackQuery):
+    # callback.data = "pg|{n|p}|{post_ts}|{id}", город берётся из сессии пользователя
+    _, direction, post_ts, shelter_id = callback.data.split("|", 3)
+    city = await get_user_city(callback.from_user.id)
+    if not city:
+        msg = await update_message(callback.message, "Выберите город:", reply_markup=build_city_keyboard())
+        await remember_message(callback.from_user.id, msg)
+    else:
+        await show_shelters(callback.message, city, (int(post_ts), shelter_id), "prev" if direction == "p" else "next")
+    await callback.answer()
 
-def trim_to_sentence(text: str, limit: int = 4096) -> str:
-    """
-    Обрезает текст, не разрывая слово, если превышает лимит.
-    """
-    if len(text) <= limit:
-        return text
-    cutoff = text[:limit]
-    if " " in cutoff:
-        cutoff = cutoff[:cutoff.rfind(" ")]
-    return cutoff + "..."
-
-def clean_info(info: str) -> tuple[str, str]:
+def build_card(row) -> tuple:
     """
-    Обрабатывает исходный текст описания:
-    - Определяет срочность: ищет ключевые слова «срочно» / «не срочно».
-    - Удаляет слова "волонтёрство" и "сбор".
-    - Убирает повторы.
-    - Если встречается раздел "что нужно:", то берётся первое предложение после него,
-      что трактуется как основная потребность.
-    Возвращает кортеж: (основная потребность, срочность)
+    Готовит неизменяемые части карточки приюта: (заголовок, описание, post_ts, link).
     """
-    # Определяем срочность
-    urgency = "Не указано"
-    lower_info = info.lower()
-    if "срочно" in lower_info:
-        urgency = "Срочно"
-    elif "не срочно" in lower_info:
-        urgency = "Не срочно"
-
-    # Удаляем нежелательные слова
-    for word in ["волонтёрство", "сбор"]:
-        info = info.replace(word, "")
-
-    # Убираем дублирующие строки
-    lines = [line.strip() for line in info.split("\n") if line.strip()]
-    seen = set()
-    unique_lines = []
-    for line in lines:
-        if line.lower() not in seen:
-            unique_lines.append(line)
-            seen.add(line.lower())
-    cleaned_info = "\n".join(unique_lines)
-
-    # Если встречается блок «что нужно:», берём первое предложение после него
-    lower_clean = cleaned_info.lower()
-    if "что нужно:" in lower_clean:
-        idx = lower_clean.index("что нужно:") + len("что нужно:")
-        remainder = cleaned_info[idx:].strip()
-        sentence = re.split(r"[.!?]", remainder)[0].strip()
-        main_need = sentence
-    else:
-        main_need = cleaned_info[:100].strip()
-
-    return main_need, urgency
+    name, link, post_ts, main_need, urgency = row
+    if main_need is None:
+        main_need, urgency = NO_INFO
+
+    # Формируем кликабельный адрес через Google Maps
+    link_encoded = quote(link)
+    link_url = f"https://www.google.com/maps/search/{link_encoded}"
+    link_html = f'<a href="{link_url}">{link}</a>'
+    head = f"<b>{name}</b>\n{link_html}\n"
+
+    body = f"\n<b>Основная потребность:</b>\n{trim_to_sentence(main_need, 400)}\n"
+    body += f"\n<b>Срочность:</b> {urgency}"
+    return head, body, post_ts, link
+
+def render_card(card) -> str:
+    head, body, post_ts, _ = card
+    msg_text = head
+    # Вычисляем, сколько дней назад был пост (меняется со временем, поэтому не кэшируется)
+    if post_ts:
+        days_ago = (datetime.now() - datetime.fromtimestamp(post_ts)).days
+        msg_text += f"\n🗓 {days_ago} дней назад\n"
+    return msg_text + body
 
 @dp.callback_query(lambda c: c.data.startswith("info_"))
 async def show_info(callback: types.CallbackQuery):
     shelter_id = callback.data[5:]
-    row = get_shelter_by_id(shelter_id)
-    if row:
-        name, link, info, post_date = row
-
-        # Формируем кликабельный адрес через Google Maps
-        link_encoded = quote(link)
-        link_url = f"https://www.google.com/maps/search/{link_encoded}"
-        link_html = f'<a href="{link_url}">{link}</a>'
-
-        msg_text = f"<b>{name}</b>\n{link_html}\n"
-
-        # Вычисляем, сколько дней назад был пост
-        if post_date:
-            try:
-                dt = datetime.strptime(post_date, "%Y-%m-%d")
-            except Exception:
-                try:
-                    dt = datetime.strptime(post_date, "%d.%m.%Y")
-                except Exception:
-                    dt = None
-            if dt:
-                days_ago = (datetime.now() - dt).days
-                msg_text += f"\n🗓 {days_ago} дней назад\n"
-
-        # Обработка и структурирование блока потребности
-        if info:
-            main_need, urgency = clean_info(info)
-        else:
-            main_need, urgency = "Нет описания.", "Не указано"
-        msg_text += f"\n<b>Основная потребность:</b>\n{trim_to_sentence(main_need, 400)}\n"
-        msg_text += f"\n<b>Срочность:</b> {urgency}"
-
+    card = render_cache.get(("shelter", shelter_id))
+    if card is None:
+        row = await get_shelter_card(shelter_id)
+        if row:
+            card = build_card(row)
+            render_cache.set(("shelter", shelter_id), card)
+    if card:
+        link = card[3]
         # Формируем дополнительную навигационную клавиатуру:
         # кнопка сохранения, вернуться к приютам (для текущего города), вернуться к городам, сохранённые посты
-        city = user_city.get(callback.from_user.id, "")
+        city = await get_user_city(callback.from_user.id)
         nav_buttons = [
             [InlineKeyboardButton(text="💾 Сохранить", callback_data=f"fav|{shelter_id}|{link}")],
             [InlineKeyboardButton(text="🏠 Вернуться к приютам", callback_data=f"back_shelters|{city}")],
@@ -232,8 +344,8 @@ async def show_info(callback: types.CallbackQuery):
         keyboard = InlineKeyboardMarkup(inline_keyboard=nav_buttons)
 
         # Редактируем сообщение, заменяя старую информацию новой
-        edited_msg = await update_message(callback.message, msg_text, reply_markup=keyboard)
-        user_last_msg[callback.from_user.id] = edited_msg
+        edited_msg = await update_message(callback.message, render_card(card), reply_markup=keyboard)
+        await remember_message(callback.from_user.id, edited_msg)
     else:
         await callback.message.answer("Не удалось найти информацию.")
     await callback.answer()
@@ -243,13 +355,13 @@ async def add_to_favorites(callback: types.CallbackQuery):
     # callback.data = "fav|{group_id}|{post_url}"
     _, group_id, post_url = callback.data.split("|")
     user_id = callback.from_user.id
-    add_favorite(user_id, post_url, group_id)
+    await add_favorite(user_id, post_url, group_id)
     await callback.answer("Добавлено в сохранённые! 💾")
 
 @dp.callback_query(lambda c: c.data == "back_cities")
 async def back_to_cities(callback: types.CallbackQuery):
     msg = await update_message(callback.message, "Привет! Выберите город, чтобы найти приюты, которым нужна помощь:", reply_markup=build_city_keyboard())
-    user_last_msg[callback.from_user.id] = msg
+    await remember_message(callback.from_user.id, msg)
     await callback.answer()
 
 @dp.callback_query(lambda c: c.data.startswith("back_shelters"))
@@ -261,7 +373,7 @@ async def back_to_shelters(callback: types.CallbackQuery):
         return
     city = parts[1]
     msg = await update_message(callback.message, f"Ищем приюты в городе {city}, подождите немного...")
-    user_last_msg[callback.from_user.id] = msg
+    await remember_message(callback.from_user.id, msg)
     await show_shelters(msg, city)
     await callback.answer()
 
@@ -269,14 +381,14 @@ async def back_to_shelters(callback: types.CallbackQuery):
 async def show_fav_menu(callback: types.CallbackQuery):
     # Показываем сохранённые посты
     user_id = callback.from_user.id
-    favorites = get_user_favorites(user_id)
+    favorites = await get_user_favorites(user_id)
     if not favorites:
         text = "У вас нет сохранённых постов."
         kb = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🌆 Вернуться к городам", callback_data="back_cities")]
         ])
         msg = await update_message(callback.message, text, reply_markup=kb)
-        user_last_msg[user_id] = msg
+        await remember_message(user_id, msg)
     else:
         text = "⭐ Сохранённые посты:\n"
         kb_buttons = []
@@ -285,13 +397,13 @@ async def show_fav_menu(callback: types.CallbackQuery):
         kb_buttons.append([InlineKeyboardButton(text="🌆 Вернуться к городам", callback_data="back_cities")])
         kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
         msg = await update_message(callback.message, text, reply_markup=kb)
-        user_last_msg[user_id] = msg
+        await remember_message(user_id, msg)
     await callback.answer()
 
 @dp.callback_query(lambda c: c.data.startswith("recent_posts_"))
 async def handle_recent_posts(callback: types.CallbackQuery):
     group_id = callback.data.replace("recent_posts_", "")
-    posts = get_recent_posts_for_group(group_id)
+    posts = await get_recent_posts_for_group(group_id)
     if posts:
         text = ""
         for url, text_part in posts:
@@ -304,7 +416,7 @@ async def handle_recent_posts(callback: types.CallbackQuery):
 @dp.message(Command("fav"))
 async def show_favorites(message: Message):
     user_id = message.from_user.id
-    favorites = get_user_favorites(user_id)
+    favorites = await get_user_favorites(user_id)
     if not favorites:
         await message.answer("У вас нет сохранённых постов.")
         return
@@ -315,4 +427,4 @@ async def show_favorites(message: Message):
     kb_buttons.append([InlineKeyboardButton(text="🌆 Вернуться к городам", callback_data="back_cities")])
     keyboard = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
     sent = await message.answer(text, reply_markup=keyboard)
-    user_last_msg[user_id] = sent
+    await remember_message(user_id, sent)
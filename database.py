@@ -1,10 +1,80 @@
+import os
+import re
 import sqlite3
+import threading
 from datetime import datetime, timedelta
 
-DB_PATH = "shelters.db"
+from formatting import shelter_need
+from metrics import db_query_seconds
+from scoring import stem
+
+DB_PATH = os.getenv("DB_PATH", "shelters.db")
+
+# Настройки соединения: WAL позволяет читать (бот) и писать (парсер) одновременно,
+# busy_timeout — ждать освобождения блокировки вместо ошибки "database is locked"
+BUSY_TIMEOUT_MS = 5000
+CACHED_STATEMENTS = 256
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+def timed_query(func):
+    """
+    Декоратор функций доступа к данным: время выполнения попадает
+    в метрику db_query_seconds{function=...}.
+    """
+    return db_query_seconds.time(func.__name__)(func)
+
+# Одно долгоживущее соединение на поток (потоки asyncio.to_thread, поток парсера и т.д.)
+_local = threading.local()
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Возвращает соединение текущего потока, создавая его при первом обращении.
+    Соединение не закрывается после каждого запроса: подготовленные выражения
+    остаются в кэше sqlite3 (cached_statements) и переиспользуются.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            DB_PATH,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            cached_statements=CACHED_STATEMENTS,
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
+    return conn
+
+def close_connection():
+    """
+    Закрывает соединение текущего потока (например, при завершении приложения).
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+    # Файл базы могли заменить — при следующем init_db схема проверится заново
+    _schema_ready.discard(DB_PATH)
+
+# Базы, схема которых уже проверена в этом процессе
+_schema_ready = set()
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    """
+    Создаёт таблицы и применяет миграции. Схема проверяется один раз на процесс:
+    если user_version уже последняя, CREATE TABLE не выполняются.
+    """
+    if DB_PATH in _schema_ready:
+        return
+    conn = get_connection()
+    if conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS):
+        _schema_ready.add(DB_PATH)
+        return
     c = conn.cursor()
 
     # Таблица приютов: добавлено поле post_date для хранения даты поста
@@ -49,83 +119,383 @@ def init_db():
         )
     """)
 
+    # Обработанные парсером посты ("{owner_id}_{post_id}") с временем обработки (unix time)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS seen_posts (
+            post_key TEXT PRIMARY KEY,
+            seen_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_seen_posts_seen_at ON seen_posts(seen_at)")
+
+    # Время последнего успешного поиска по городу (unix time)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS city_runs (
+            city TEXT PRIMARY KEY,
+            last_success INTEGER
+        )
+    """)
+
     conn.commit()
-    conn.close()
+    migrate(conn)
+    _schema_ready.add(DB_PATH)
+
+# Форматы, в которых post_date встречается в базе
+POST_DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%d.%m.%Y")
+
+def post_timestamp(post_date) -> int:
+    """
+    Переводит post_date в unix time для сортировки; 0 — дата не указана или не распознана.
+    """
+    for fmt in POST_DATE_FORMATS:
+        try:
+            return int(datetime.strptime(post_date, fmt).timestamp())
+        except (TypeError, ValueError):
+            continue
+    return 0
+
+def _migrate_v1(conn):
+    # Сортируемая дата поста (post_ts) и индексы под запросы бота
+    columns = [r[1] for r in conn.execute("PRAGMA table_info(shelters)")]
+    if "post_ts" not in columns:
+        conn.execute("ALTER TABLE shelters ADD COLUMN post_ts INTEGER NOT NULL DEFAULT 0")
+    rows = conn.execute("SELECT id, post_date FROM shelters WHERE post_ts = 0 AND post_date != ''").fetchall()
+    conn.executemany(
+        "UPDATE shelters SET post_ts = ? WHERE id = ?",
+        [(post_timestamp(post_date), shelter_id) for shelter_id, post_date in rows]
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_shelters_city_post_ts ON shelters(city, post_ts, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_favorites_user_added ON favorites(user_id, added_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_favorites_group ON favorites(group_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_favorite_posts_group_added ON favorite_posts(group_id, added_at)")
 
+def _migrate_v2(conn):
+    # Полнотекстовый индекс FTS5 по name и info, синхронизируемый триггерами.
+    # unicode61 приводит кириллицу к нижнему регистру и убирает диакритику (ё -> е)
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS shelters_fts USING fts5(
+            name, info,
+            content='shelters', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS shelters_fts_insert AFTER INSERT ON shelters BEGIN
+            INSERT INTO shelters_fts(rowid, name, info) VALUES (new.rowid, new.name, new.info);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS shelters_fts_delete AFTER DELETE ON shelters BEGIN
+            INSERT INTO shelters_fts(shelters_fts, rowid, name, info) VALUES ('delete', old.rowid, old.name, old.info);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS shelters_fts_update AFTER UPDATE OF name, info ON shelters BEGIN
+            INSERT INTO shelters_fts(shelters_fts, rowid, name, info) VALUES ('delete', old.rowid, old.name, old.info);
+            INSERT INTO shelters_fts(rowid, name, info) VALUES (new.rowid, new.name, new.info);
+        END
+    """)
+    conn.execute("INSERT INTO shelters_fts(shelters_fts) VALUES ('rebuild')")
+
+def _migrate_v3(conn):
+    # Сессии пользователей для SQLiteSessionStore (sessions.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id INTEGER PRIMARY KEY,
+            city TEXT,
+            chat_id INTEGER,
+            message_id INTEGER,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)")
+
+def _migrate_v4(conn):
+    # Основная потребность и срочность считаются один раз при сохранении, а не при каждом показе
+    columns = [r[1] for r in conn.execute("PRAGMA table_info(shelters)")]
+    if "main_need" not in columns:
+        conn.execute("ALTER TABLE shelters ADD COLUMN main_need TEXT")
+    if "urgency" not in columns:
+        conn.execute("ALTER TABLE shelters ADD COLUMN urgency TEXT")
+    rows = conn.execute("SELECT id, info FROM shelters WHERE main_need IS NULL").fetchall()
+    conn.executemany(
+        "UPDATE shelters SET main_need = ?, urgency = ? WHERE id = ?",
+        [(*shelter_need(info), shelter_id) for shelter_id, info in rows]
+    )
+
+def _migrate_v5(conn):
+    # Последний обработанный пост каждой отслеживаемой группы VK (см. favorites_watcher.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS group_watermarks (
+            owner_id INTEGER PRIMARY KEY,
+            last_post_id INTEGER NOT NULL,
+            checked_at INTEGER NOT NULL
+        )
+    """)
+
+def _migrate_v6(conn):
+    # Служебные значения приложения (ключ -> значение) и курсоры доставки уведомлений:
+    # последний favorite_posts.id, о котором пользователь уже уведомлён
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS app_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notification_cursors (
+            user_id INTEGER PRIMARY KEY,
+            last_post_row INTEGER NOT NULL
+        )
+    """)
+
+def _migrate_v7(conn):
+    # Аренды (leases) для координации нескольких процессов: лидер парсинга,
+    # разбор города по запросу; и update_id уже принятых обновлений Telegram
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY,
+            received_at INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_processed_updates_received ON processed_updates (received_at)")
+
+def _migrate_v8(conn):
+    # Один пост стены нужен каждому сохранённому приюту этой группы: уникальность
+    # по паре (group_id, post_url) вместо post_url. SQLite не меняет ограничения
+    # через ALTER TABLE, поэтому таблица пересоздаётся с сохранением id
+    conn.execute("""
+        CREATE TABLE favorite_posts_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id TEXT,
+            post_url TEXT,
+            text TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (group_id, post_url)
+        )
+    """)
+    conn.execute("""
+        INSERT INTO favorite_posts_new (id, group_id, post_url, text, added_at)
+        SELECT id, group_id, post_url, text, added_at FROM favorite_posts
+    """)
+    conn.execute("DROP TABLE favorite_posts")
+    conn.execute("ALTER TABLE favorite_posts_new RENAME TO favorite_posts")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_favorite_posts_group_added ON favorite_posts(group_id, added_at)")
+
+def _migrate_v9(conn):
+    # Посты, сохранённые при первой проверке группы (за FIRST_CHECK_DAYS), показываются
+    # в боте, но не рассылаются подписчикам как новые
+    conn.execute("ALTER TABLE favorite_posts ADD COLUMN notify INTEGER NOT NULL DEFAULT 1")
+
+def _migrate_v10(conn):
+    # Последний запрос /search: кнопки листания передают в callback_data только смещение
+    conn.execute("ALTER TABLE sessions ADD COLUMN search_query TEXT")
+
+# Миграции схемы по порядку; номер текущей версии хранится в PRAGMA user_version
+MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6, _migrate_v7, _migrate_v8, _migrate_v9, _migrate_v10]
+
+def migrate(conn):
+    """
+    Применяет недостающие миграции, каждую в своей транзакции BEGIN IMMEDIATE.
+    Модуль sqlite3 сам не открывает транзакцию для DDL и PRAGMA, поэтому без явного
+    BEGIN шаг применялся бы по частям. Версия перечитывается под блокировкой:
+    другой процесс мог применить тот же шаг, пока мы ждали.
+    """
+    conn.commit()
+    for number, step in enumerate(MIGRATIONS, start=1):
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            applied = conn.execute("PRAGMA user_version").fetchone()[0] < number
+            if applied:
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if applied:
+            print(f"База данных обновлена до версии {number}")
+
+@timed_query
 def add_shelter(id, name, link, city, info="", post_date=""):
     """
     Добавляет запись о приюте в базу.
     Если запись с таким id уже существует, она не перезаписывается.
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     try:
-        c.execute("INSERT INTO shelters VALUES (?, ?, ?, ?, ?, ?)", (id, name, link, city, info, post_date))
-        conn.commit()
+        # with conn: при ошибке откатывает транзакцию, чтобы не держать блокировку записи
+        with conn:
+            c.execute(
+                "INSERT INTO shelters (id, name, link, city, info, post_date, post_ts, main_need, urgency)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (id, name, link, city, info, post_date, post_timestamp(post_date), *shelter_need(info))
+            )
     except sqlite3.IntegrityError:
         pass
-    conn.close()
+
+@timed_query
+def add_shelters(rows):
+    """
+    Сохраняет пачку приютов одной транзакцией.
+    rows — кортежи (id, name, link, city, info, post_date); существующие записи обновляются.
+    """
+    conn = get_connection()
+    with conn:
+        conn.executemany("""
+            INSERT INTO shelters (id, name, link, city, info, post_date, post_ts, main_need, urgency)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                name = excluded.name,
+                link = excluded.link,
+                city = excluded.city,
+                info = excluded.info,
+                post_date = excluded.post_date,
+                post_ts = excluded.post_ts,
+                main_need = excluded.main_need,
+                urgency = excluded.urgency
+        """, [row + (post_timestamp(row[5]), *shelter_need(row[4])) for row in rows])
+
+def build_fts_query(text: str) -> str:
+    """
+    Превращает пользовательский запрос в запрос FTS5: каждое слово сводится
+    к основе и ищется по префиксу ("корма" -> "корм"*), слова объединяются через AND.
+    """
+    return " ".join(f'"{stem(word)}"*' for word in re.findall(r"\w+", text.lower()))
+
+@timed_query
+def search_shelters(query: str, city: str = None, limit: int = 10, offset: int = 0):
+    """
+    Полнотекстовый поиск приютов по name и info, по убыванию релевантности (bm25).
+    Возвращает список (id, name, city) для страницы limit/offset.
+    """
+    fts_query = build_fts_query(query)
+    if not fts_query:
+        return []
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT s.id, s.name, s.city FROM shelters_fts
+        JOIN shelters s ON s.rowid = shelters_fts.rowid
+        WHERE shelters_fts MATCH ? AND (? IS NULL OR s.city = ?)
+        ORDER BY bm25(shelters_fts)
+        LIMIT ? OFFSET ?
+    """, (fts_query, city, city, limit, offset))
+    return cursor.fetchall()
 
 def get_filtered_shelters(city: str, filter_keyword: str):
     """
-    Возвращает приюты для указанного города, у которых в info встречается ключевое слово.
+    Возвращает приюты для указанного города, у которых в name или info встречается ключевое слово.
+    Время запроса учитывается в search_shelters.
     """
-    conn = sqlite3.connect("shelters.db")
-    c = conn.cursor()
-    c.execute(
-        "SELECT id, name FROM shelters WHERE city = ? AND info LIKE ?",
-        (city, f"%{filter_keyword}%")
-    )
-    results = c.fetchall()
-    conn.close()
-    return results
+    return [(shelter_id, name) for shelter_id, name, _ in search_shelters(filter_keyword, city, limit=-1)]
 
+@timed_query
 def get_shelters_for_city(city, limit=20):
     """
     Возвращает список приютов для указанного города.
     Теперь НЕ фильтрует по таблице shown_shelters – выводятся все записи,
     отсортированные по дате поста (сначала самые свежие).
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
-    # Если поле post_date заполнено, сортируем по нему, иначе по ROWID
+    # post_ts — дата поста в unix time (0, если не указана); сортировка идёт по индексу
     cursor.execute("""
-        SELECT * FROM shelters
+        SELECT id, name, link, city, info, post_date FROM shelters
         WHERE city = ?
-        ORDER BY CASE 
-                    WHEN post_date != '' THEN datetime(post_date)
-                    ELSE ROWID
-                 END DESC
+        ORDER BY post_ts DESC, id DESC
         LIMIT ?
     """, (city, limit))
     result = cursor.fetchall()
-    conn.close()
     return result
 
+@timed_query
+def get_shelters_page(city, cursor=None, direction="next", limit=10):
+    """
+    Возвращает страницу приютов города (от новых к старым) по ключу (post_ts, id):
+    direction="next" — записи после cursor, "prev" — перед ним; cursor=None — первая страница.
+    Результат: (список (id, name, post_ts), есть ли ещё записи в направлении листания).
+    Стоимость страницы не зависит от её номера: выборка идёт по индексу (city, post_ts, id).
+    """
+    conn = get_connection()
+    cursor_db = conn.cursor()
+    if cursor is None:
+        cursor_db.execute("""
+            SELECT id, name, post_ts FROM shelters
+            WHERE city = ?
+            ORDER BY post_ts DESC, id DESC
+            LIMIT ?
+        """, (city, limit + 1))
+    elif direction == "prev":
+        cursor_db.execute("""
+            SELECT id, name, post_ts FROM shelters
+            WHERE city = ? AND (post_ts, id) > (?, ?)
+            ORDER BY post_ts ASC, id ASC
+            LIMIT ?
+        """, (city, cursor[0], cursor[1], limit + 1))
+    else:
+        cursor_db.execute("""
+            SELECT id, name, post_ts FROM shelters
+            WHERE city = ? AND (post_ts, id) < (?, ?)
+            ORDER BY post_ts DESC, id DESC
+            LIMIT ?
+        """, (city, cursor[0], cursor[1], limit + 1))
+    rows = cursor_db.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if cursor is not None and direction == "prev":
+        rows.reverse()
+    return rows, has_more
+
+@timed_query
 def get_shelter_by_id(shelter_id):
     """
     Возвращает запись по идентификатору приюта в виде кортежа:
       (name, link, info, post_date)
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT name, link, info, post_date FROM shelters WHERE id = ?", (shelter_id,))
     row = cursor.fetchone()
-    conn.close()
     return row
 
+@timed_query
+def get_shelter_card(shelter_id):
+    """
+    Возвращает данные для карточки приюта:
+      (name, link, post_ts, main_need, urgency)
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT name, link, post_ts, main_need, urgency FROM shelters WHERE id = ?",
+        (shelter_id,)
+    )
+    return cursor.fetchone()
+
+@timed_query
 def add_favorite(user_id, post_url, group_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
         INSERT OR IGNORE INTO favorites (user_id, post_url, group_id)
         VALUES (?, ?, ?)
     """, (user_id, post_url, group_id))
     conn.commit()
-    conn.close()
 
+@timed_query
 def get_user_favorites(user_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT post_url, group_id FROM favorites
@@ -133,11 +503,11 @@ def get_user_favorites(user_id):
         ORDER BY added_at DESC
     """, (user_id,))
     favorites = cursor.fetchall()
-    conn.close()
     return favorites
 
+@timed_query
 def get_recent_posts_for_group(group_id, days=7):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cutoff = datetime.now() - timedelta(days=days)
     cursor.execute("""
@@ -146,37 +516,137 @@ def get_recent_posts_for_group(group_id, days=7):
         ORDER BY added_at DESC
     """, (group_id, cutoff))
     posts = cursor.fetchall()
-    conn.close()
     return posts
 
+@timed_query
 def get_favorite_group_ids():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT DISTINCT group_id FROM favorites")
     result = cursor.fetchall()
-    conn.close()
     return [r[0] for r in result]
 
+@timed_query
 def post_already_saved(post_url):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT 1 FROM favorite_posts WHERE post_url = ?", (post_url,))
     result = cursor.fetchone()
-    conn.close()
     return result is not None
 
+@timed_query
 def save_favorite_post(group_id, post_url, text):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
         INSERT OR IGNORE INTO favorite_posts (group_id, post_url, text)
         VALUES (?, ?, ?)
     """, (group_id, post_url, text))
     conn.commit()
-    conn.close()
 
+@timed_query
+def get_group_watermarks():
+    """
+    Возвращает {owner_id: last_post_id} для отслеживаемых групп.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT owner_id, last_post_id FROM group_watermarks")
+    return dict(cursor.fetchall())
+
+@timed_query
+def save_group_posts(posts, watermarks, checked_at):
+    """
+    Одной транзакцией сохраняет новые посты групп и сдвигает отметки последних постов.
+    posts — кортежи (group_id, post_url, text, added_at, notify), watermarks — {owner_id: last_post_id}.
+    Возвращает число действительно добавленных постов.
+    """
+    conn = get_connection()
+    before = conn.total_changes
+    with conn:
+        conn.executemany("""
+            INSERT OR IGNORE INTO favorite_posts (group_id, post_url, text, added_at, notify)
+            VALUES (?, ?, ?, ?, ?)
+        """, posts)
+        inserted = conn.total_changes - before
+        conn.executemany("""
+            INSERT INTO group_watermarks (owner_id, last_post_id, checked_at) VALUES (?, ?, ?)
+            ON CONFLICT(owner_id) DO UPDATE SET
+                last_post_id = max(last_post_id, excluded.last_post_id),
+                checked_at = excluded.checked_at
+        """, [(owner_id, post_id, checked_at) for owner_id, post_id in watermarks.items()])
+    return inserted
+
+@timed_query
+def get_state(key, default=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM app_state WHERE key = ?", (key,))
+    row = cursor.fetchone()
+    return row[0] if row else default
+
+@timed_query
+def set_state(key, value):
+    conn = get_connection()
+    with conn:
+        conn.execute("""
+            INSERT INTO app_state (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (key, value))
+
+@timed_query
+def increment_state(key) -> int:
+    """
+    Атомарно увеличивает числовое значение key в app_state и возвращает новое значение.
+    """
+    conn = get_connection()
+    with conn:
+        conn.execute("""
+            INSERT INTO app_state (key, value) VALUES (?, '1')
+            ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+        """, (key,))
+        row = conn.execute("SELECT value FROM app_state WHERE key = ?", (key,)).fetchone()
+    return int(row[0])
+
+@timed_query
+def get_max_favorite_post_row():
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM favorite_posts")
+    return cursor.fetchone()[0]
+
+@timed_query
+def get_pending_notifications(after_row):
+    """
+    Новые посты групп из избранного для каждого подписчика одним запросом:
+    список (user_id, favorite_posts.id, post_url, text), упорядоченный по пользователю.
+    Учитывает общий курсор after_row и персональные курсоры доставки;
+    посты первой проверки группы (notify = 0) не рассылаются.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT DISTINCT f.user_id, p.id, p.post_url, p.text
+        FROM favorite_posts p
+        JOIN favorites f ON f.group_id = p.group_id
+        LEFT JOIN notification_cursors c ON c.user_id = f.user_id
+        WHERE p.id > ? AND p.id > COALESCE(c.last_post_row, 0) AND p.notify = 1
+        ORDER BY f.user_id, p.id
+    """, (after_row,))
+    return cursor.fetchall()
+
+@timed_query
+def set_notification_cursor(user_id, last_post_row):
+    conn = get_connection()
+    with conn:
+        conn.execute("""
+            INSERT INTO notification_cursors (user_id, last_post_row) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET last_post_row = max(last_post_row, excluded.last_post_row)
+        """, (user_id, last_post_row))
+
+@timed_query
 def get_latest_favorite_posts(limit=10):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT post_url, text FROM favorite_posts
@@ -184,16 +654,155 @@ def get_latest_favorite_posts(limit=10):
         LIMIT ?
     """, (limit,))
     result = cursor.fetchall()
-    conn.close()
     return result
 
+@timed_query
+def load_seen_posts(since):
+    """
+    Возвращает ключи постов, обработанных не раньше since (unix time).
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT post_key FROM seen_posts WHERE seen_at >= ?", (since,))
+    return [r[0] for r in cursor.fetchall()]
+
+@timed_query
+def add_seen_posts(rows):
+    """
+    Дописывает пары (post_key, seen_at) одной транзакцией.
+    """
+    conn = get_connection()
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO seen_posts (post_key, seen_at) VALUES (?, ?)", rows)
+
+@timed_query
+def expire_seen_posts(before):
+    """
+    Удаляет записи об обработанных постах старше before (unix time).
+    Возвращает число удалённых строк.
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute("DELETE FROM seen_posts WHERE seen_at < ?", (before,))
+    return cursor.rowcount
+
+@timed_query
+def get_city_last_run(city):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT last_success FROM city_runs WHERE city = ?", (city,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+@timed_query
+def set_city_last_run(city, timestamp):
+    conn = get_connection()
+    with conn:
+        conn.execute("""
+            INSERT INTO city_runs (city, last_success) VALUES (?, ?)
+            ON CONFLICT(city) DO UPDATE SET last_success = excluded.last_success
+        """, (city, timestamp))
+
+SESSION_COLUMNS = ("city", "chat_id", "message_id", "search_query")
+
+@timed_query
+def get_session(user_id, since):
+    """
+    Возвращает (city, chat_id, message_id, search_query) пользователя, если сессия обновлялась не раньше since.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT city, chat_id, message_id, search_query FROM sessions WHERE user_id = ? AND updated_at >= ?",
+        (user_id, since)
+    )
+    return cursor.fetchone()
+
+@timed_query
+def update_session(user_id, fields, updated_at):
+    """
+    Обновляет переданные поля сессии (SESSION_COLUMNS), создавая её при необходимости.
+    """
+    columns = [name for name in SESSION_COLUMNS if name in fields]
+    values = [fields[name] for name in columns]
+    updates = "".join(f", {name} = excluded.{name}" for name in columns)
+    conn = get_connection()
+    with conn:
+        conn.execute(f"""
+            INSERT INTO sessions (user_id, updated_at{"".join(", " + name for name in columns)})
+            VALUES (?, ?{", ?" * len(columns)})
+            ON CONFLICT(user_id) DO UPDATE SET updated_at = excluded.updated_at{updates}
+        """, (user_id, updated_at, *values))
+
+@timed_query
+def expire_sessions(before):
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM sessions WHERE updated_at < ?", (before,))
+
+@timed_query
+def acquire_lease(name, holder, ttl, now):
+    """
+    Берёт или продлевает аренду name на ttl секунд. Успешно, если аренда свободна,
+    истекла или уже принадлежит holder. Возвращает True, если holder держит аренду.
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute("""
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+        """, (name, holder, now + ttl, now))
+    return cursor.rowcount == 1
+
+@timed_query
+def release_lease(name, holder):
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+@timed_query
+def get_lease(name):
+    """
+    Возвращает (holder, expires_at) аренды или None.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (name,))
+    return cursor.fetchone()
+
+@timed_query
+def claim_update(update_id, received_at):
+    """
+    Отмечает обновление Telegram принятым. Возвращает False, если его уже принял
+    этот или другой процесс (повторная доставка).
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO processed_updates (update_id, received_at) VALUES (?, ?)",
+            (update_id, received_at),
+        )
+    return cursor.rowcount == 1
+
+@timed_query
+def unclaim_update(update_id):
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM processed_updates WHERE update_id = ?", (update_id,))
+
+@timed_query
+def expire_processed_updates(before):
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM processed_updates WHERE received_at < ?", (before,))
+
 # Для отладки (необязательно)
 def list_tables():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
     tables = cursor.fetchall()
-    conn.close()
     return [t[0] for t in tables]
 
 if __name__ == "__main__":
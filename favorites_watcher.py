@@ -0,0 +1,130 @@
+import time
+from datetime import datetime
+
+import vk_api
+from database import get_favorite_group_ids, get_group_watermarks, save_group_posts
+
+WALL_COUNT = 20  # постов со стены за один wall.get
+# Сколько страниц стены листать за проверку, пока не дойдём до прошлой отметки
+WALL_MAX_PAGES = 5
+FIRST_CHECK_DAYS = 7  # при первой проверке группы сохраняем посты не старше этого срока
+
+def owner_from_group_id(group_id: str):
+    """
+    В favorites.group_id хранится id приюта вида "{owner_id}_{post_id}" (или просто owner_id).
+    Возвращает owner_id стены VK либо None, если строку не удалось разобрать.
+    """
+    try:
+        return int(str(group_id).rsplit("_", 1)[0]) if "_" in str(group_id) else int(group_id)
+    except ValueError:
+        return None
+
+def reached_watermark(items, last_post_id, min_date) -> bool:
+    """
+    Дошла ли страница стены до уже просмотренного: до поста с id не больше last_post_id
+    (при первой проверке — до поста старше min_date) или до конца стены.
+    Закреплённый пост может быть старым и стоит первым, поэтому не учитывается.
+    """
+    if len(items) < WALL_COUNT:
+        return True
+    for post in items:
+        if post.get("is_pinned"):
+            continue
+        if last_post_id is not None and post["id"] <= last_post_id:
+            return True
+        if last_post_id is None and post["date"] < min_date:
+            return True
+    return False
+
+def fetch_walls(owner_ids, watermarks, now):
+    """
+    Загружает стены через execute (до 25 групп за запрос), листая offset, пока каждая
+    стена не дойдёт до прошлой отметки или не будет прочитано WALL_MAX_PAGES страниц.
+    Возвращает {owner_id: посты}; недоступные стены в результат не попадают.
+    """
+    min_date = now - FIRST_CHECK_DAYS * 86400
+    walls = {owner_id: [] for owner_id in owner_ids}
+    pending = list(owner_ids)
+    for page in range(WALL_MAX_PAGES):
+        if not pending:
+            break
+        results = vk_api.execute([
+            ("wall.get", {"owner_id": owner_id, "count": WALL_COUNT, "offset": page * WALL_COUNT})
+            for owner_id in pending
+        ])
+        next_pending = []
+        for owner_id, result in zip(pending, results):
+            if isinstance(result, vk_api.VKError):
+                # Без части страниц отметку сдвигать нельзя — стена проверится в следующий раз
+                print(f"Стена {owner_id} недоступна: {result.message}")
+                del walls[owner_id]
+                continue
+            items = result.get("items", [])
+            walls[owner_id].extend(items)
+            if not reached_watermark(items, watermarks.get(owner_id), min_date):
+                next_pending.append(owner_id)
+        pending = next_pending
+    for owner_id in pending:
+        print(f"⚠️ На стене {owner_id} больше {WALL_MAX_PAGES * WALL_COUNT} новых постов с прошлой проверки, "
+              f"более старые пропущены")
+    return walls
+
+def new_posts_for_owner(owner_id, items, last_post_id, group_ids, now):
+    """
+    Отбирает посты новее отметки last_post_id и превращает их в строки favorite_posts.
+    Посты первой проверки группы (за FIRST_CHECK_DAYS) сохраняются без рассылки подписчикам.
+    Возвращает (строки, новая отметка).
+    """
+    rows = []
+    newest = last_post_id or 0
+    min_date = now - FIRST_CHECK_DAYS * 86400
+    notify = 0 if last_post_id is None else 1
+    for post in items:
+        post_id = post["id"]
+        newest = max(newest, post_id)
+        if last_post_id is not None and post_id <= last_post_id:
+            continue
+        if last_post_id is None and post["date"] < min_date:
+            continue
+        post_url = f"https://vk.com/wall{owner_id}_{post_id}"
+        added_at = datetime.fromtimestamp(post["date"]).strftime("%Y-%m-%d %H:%M:%S")
+        for group_id in group_ids:
+            rows.append((group_id, post_url, post.get("text", ""), added_at, notify))
+    return rows, newest
+
+def poll_favorite_groups():
+    """
+    Проверяет стены всех групп из избранного и сохраняет новые посты в favorite_posts.
+    Стены запрашиваются через execute по 25 групп, каждая пачка сохраняется одной транзакцией.
+    """
+    owners = {}
+    for group_id in get_favorite_group_ids():
+        owner_id = owner_from_group_id(group_id)
+        if owner_id is not None:
+            owners.setdefault(owner_id, []).append(group_id)
+    if not owners:
+        return 0
+
+    watermarks = get_group_watermarks()
+    owner_ids = list(owners)
+    total = 0
+    for i in range(0, len(owner_ids), vk_api.EXECUTE_MAX_CALLS):
+        batch = owner_ids[i:i + vk_api.EXECUTE_MAX_CALLS]
+        now = int(time.time())
+        try:
+            walls = fetch_walls(batch, watermarks, now)
+        except Exception as e:
+            print(f"Ошибка при проверке избранных групп: {e}")
+            continue
+
+        rows = []
+        new_marks = {}
+        for owner_id, items in walls.items():
+            posts, newest = new_posts_for_owner(owner_id, items, watermarks.get(owner_id), owners[owner_id], now)
+            rows.extend(posts)
+            if newest:
+                new_marks[owner_id] = newest
+        total += save_group_posts(rows, new_marks, now)
+
+    print(f"⭐ Новых постов в избранных группах: {total}")
+    return total
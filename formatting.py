@@ -0,0 +1,68 @@
+import re
+
+# Значения по умолчанию для постов без текста
+NO_INFO = ("Нет описания.", "Не указано")
+
+def trim_to_sentence(text: str, limit: int = 4096) -> str:
+    """
+    Обрезает текст, не разрывая слово, если превышает лимит.
+    """
+    if len(text) <= limit:
+        return text
+    cutoff = text[:limit]
+    if " " in cutoff:
+        cutoff = cutoff[:cutoff.rfind(" ")]
+    return cutoff + "..."
+
+def clean_info(info: str) -> tuple[str, str]:
+    """
+    Обрабатывает исходный текст описания:
+    - Определяет срочность: ищет ключевые слова «срочно» / «не срочно».
+    - Удаляет слова "волонтёрство" и "сбор".
+    - Убирает повторы.
+    - Если встречается раздел "что нужно:", то берётся первое предложение после него,
+      что трактуется как основная потребность.
+    Возвращает кортеж: (основная потребность, срочность)
+    """
+    # Определяем срочность
+    urgency = "Не указано"
+    lower_info = info.lower()
+    if "срочно" in lower_info:
+        urgency = "Срочно"
+    elif "не срочно" in lower_info:
+        urgency = "Не срочно"
+
+    # Удаляем нежелательные слова
+    for word in ["волонтёрство", "сбор"]:
+        info = info.replace(word, "")
+
+    # Убираем дублирующие строки
+    lines = [line.strip() for line in info.split("\n") if line.strip()]
+    seen = set()
+    unique_lines = []
+    for line in lines:
+        if line.lower() not in seen:
+            unique_lines.append(line)
+            seen.add(line.lower())
+    cleaned_info = "\n".join(unique_lines)
+
+    # Если встречается блок «что нужно:», берём первое предложение после него
+    lower_clean = cleaned_info.lower()
+    if "что нужно:" in lower_clean:
+        idx = lower_clean.index("что нужно:") + len("что нужно:")
+        remainder = cleaned_info[idx:].strip()
+        sentence = re.split(r"[.!?]", remainder)[0].strip()
+        main_need = sentence
+    else:
+        main_need = cleaned_info[:100].strip()
+
+    return main_need, urgency
+
+def shelter_need(info: str) -> tuple[str, str]:
+    """
+    Основная потребность и срочность для карточки приюта.
+    Вычисляется один раз при сохранении поста (см. database.add_shelters).
+    """
+    if not info:
+        return NO_INFO
+    return clean_info(info)
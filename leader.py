@@ -0,0 +1,131 @@
+import asyncio
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+
+import async_db
+import database
+
+# Аренда лидера: держатель продлевает её каждые LEASE_HEARTBEAT секунд; если он
+# перестал отвечать, другой процесс перехватывает аренду через LEASE_TTL
+LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "30"))
+LEASE_HEARTBEAT = float(os.getenv("LEADER_HEARTBEAT", "10"))
+# Разбор города по запросу пользователя: одна аренда на город для всех процессов
+CITY_PARSE_TTL = 10 * 60
+CITY_PARSE_POLL = 1.0
+
+# Идентификатор процесса для таблицы leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def multiple_workers() -> bool:
+    """
+    Может ли рядом работать ещё один процесс бота. WEB_CONCURRENCY задаёт число
+    воркеров не всегда: uvicorn --workers N запускает их через multiprocessing,
+    поэтому дочерний процесс тоже считается одним из нескольких.
+    MULTI_WORKER=1/0 задаёт ответ явно (например, для gunicorn).
+    """
+    forced = os.getenv("MULTI_WORKER")
+    if forced:
+        return forced == "1"
+    return int(os.getenv("WEB_CONCURRENCY", "1")) > 1 or multiprocessing.parent_process() is not None
+
+async def _call(func):
+    if func is None:
+        return
+    result = func()
+    if asyncio.iscoroutine(result):
+        await result
+
+class LeaderLease:
+    """
+    Выборы лидера через таблицу leases в общей SQLite-базе: при нескольких воркерах
+    uvicorn только лидер запускает фоновый парсинг. on_elected/on_lost вызываются
+    при получении и потере аренды, on_heartbeat — на каждом продлении у лидера.
+    """
+    def __init__(self, name: str, on_elected=None, on_lost=None, on_heartbeat=None,
+                 ttl: float = LEASE_TTL, heartbeat: float = LEASE_HEARTBEAT):
+        self.name = name
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.on_heartbeat = on_heartbeat
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.is_leader = False
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.is_leader:
+            await self._set_leader(False)
+            # Освобождаем аренду сразу, чтобы другой воркер не ждал истечения TTL
+            await async_db.release_lease(self.name, WORKER_ID)
+
+    async def status(self) -> dict:
+        lease = await async_db.get_lease(self.name)
+        return {
+            "worker": WORKER_ID,
+            "is_leader": self.is_leader,
+            "leader": lease[0] if lease and lease[1] >= time.time() else None,
+        }
+
+    async def _set_leader(self, value: bool):
+        if value == self.is_leader:
+            return
+        self.is_leader = value
+        print(f"{'👑 Получена' if value else '⚠️ Потеряна'} аренда {self.name} ({WORKER_ID})")
+        try:
+            await _call(self.on_elected if value else self.on_lost)
+        except Exception as e:
+            print(f"Ошибка смены лидера {self.name}: {e}")
+
+    async def _loop(self):
+        while True:
+            try:
+                acquired = await async_db.acquire_lease(self.name, WORKER_ID, self.ttl, time.time())
+            except Exception as e:
+                # Не смогли продлить — считаем аренду потерянной, чтобы не было двух лидеров
+                print(f"Ошибка продления аренды {self.name}: {e}")
+                acquired = False
+            await self._set_leader(acquired)
+            if acquired:
+                try:
+                    await _call(self.on_heartbeat)
+                except Exception as e:
+                    print(f"Ошибка фоновой задачи лидера: {e}")
+            await asyncio.sleep(self.heartbeat)
+
+@contextmanager
+def exclusive(name: str, ttl: float = CITY_PARSE_TTL, poll: float = CITY_PARSE_POLL):
+    """
+    Синхронная блокировка между процессами и потоками через таблицу leases.
+    Отдаёт True, если блокировка взята (работу выполняет этот поток), или
+    False, если её держал другой поток или процесс и она уже освобождена — результат его работы готов.
+    Держатель — уникальный токен на каждый захват: acquire_lease продлевает аренду тому же
+    держателю, поэтому с общим WORKER_ID два потока процесса взяли бы её одновременно.
+    """
+    holder = f"{WORKER_ID}:{uuid.uuid4().hex}"
+    if database.acquire_lease(name, holder, ttl, time.time()):
+        try:
+            yield True
+        finally:
+            database.release_lease(name, holder)
+        return
+    while True:
+        lease = database.get_lease(name)
+        if lease is None or lease[1] < time.time():
+            break
+        time.sleep(poll)
+    yield False
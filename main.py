@@ -1,41 +1,132 @@
+import startup  # первым: отсюда отсчитывается время запуска
+import asyncio
+import importlib
 import os
 import time
-from threading import Thread
-from dotenv import load_dotenv
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import Update
+# Переменные окружения загружаются до импорта модулей проекта: они читают настройки при импорте
+with startup.phase("import dotenv"):
+    from dotenv import load_dotenv
+    load_dotenv()
+with startup.phase("import fastapi"):
+    from fastapi import FastAPI, Request, Response
+    from fastapi.responses import PlainTextResponse
+with startup.phase("import aiogram"):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.types import Update
+    # Части aiogram, которые нужны bot.py и notifications.py, — в этот же этап
+    import aiogram.exceptions
+    import aiogram.filters
 
+# Модули проекта импортируются по одному в порядке зависимостей: этап каждого модуля
+# измеряет только его собственный импорт, его зависимости уже загружены предыдущими этапами
+PROJECT_MODULES = (
+    "metrics", "formatting", "scoring", "database", "async_db", "leader", "sessions",
+    "singleflight", "render_cache", "scheduler", "bot", "notifications", "webhook_queue",
+)
+for module in PROJECT_MODULES:
+    with startup.phase(f"import {module}"):
+        importlib.import_module(module)
+
+import async_db
 from bot import dp
-from run_parser import update_all_cities
+from leader import LeaderLease, multiple_workers
+from metrics import registry
+from notifications import Notifier
+from render_cache import RENDER_GENERATION_KEY, render_cache
+from scheduler import scheduler
+from webhook_queue import UpdateQueue
+# Парсер (vk_parser, requests) и кэш обработанных постов загружаются при первом запуске парсинга
 
-# Загрузка переменных окружения
-load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("TELEGRAM_TOKEN")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "supersecret")
 RENDER_URL = os.getenv("RENDER_EXTERNAL_URL")
 PORT = int(os.getenv("PORT", "10000"))
-
-# Пусть к файлу последнего запуска
-LAST_RUN_FILE = "last_run.txt"
-MIN_INTERVAL_SECONDS = 60 * 30  # 30 минут
+# Адрес Bot API; переопределяется для локального сервера или заглушки (bench/)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Сколько помнить update_id в общей таблице и как часто сверять кэши с другими воркерами
+UPDATE_DEDUP_TTL = 24 * 60 * 60
+SHARED_SYNC_INTERVAL = 5
+# Ключ app_state: /run-parser, принятый не лидером, выполняет лидер
+PARSER_REQUEST_KEY = "run_parser_requested"
 
 # Инициализация компонентов
-bot = Bot(token=TOKEN)
-storage = MemoryStorage()
+if TELEGRAM_API_URL:
+    bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=TOKEN)
+
+async def process_update(update: Update):
+    await dp.feed_update(bot, update)
+
+async def claim_update(update_id: int) -> bool:
+    return await async_db.claim_update(update_id, int(time.time()))
+
+# При нескольких воркерах повторы update_id отсеиваются через общую таблицу processed_updates
+if multiple_workers():
+    update_queue = UpdateQueue(process_update, claim=claim_update, unclaim=async_db.unclaim_update)
+else:
+    update_queue = UpdateQueue(process_update)
+registry.gauge("webhook_queue_depth", "Обновления Telegram в очереди на обработку", update_queue.depth)
+# Дайджесты новых постов из избранного рассылаются после каждой проверки стен групп
+notifier = Notifier(bot)
+scheduler.favorites_hooks.append(notifier.run_once)
+
+def parser_cities():
+    from run_parser import CITIES
+    return CITIES
+
+async def leader_heartbeat():
+    # Запросы /run-parser, принятые другими воркерами
+    if await async_db.get_state(PARSER_REQUEST_KEY):
+        await async_db.set_state(PARSER_REQUEST_KEY, None)
+        scheduler.enqueue()
+    await async_db.expire_processed_updates(int(time.time()) - UPDATE_DEDUP_TTL)
+
+# Фоновый парсинг и рассылки выполняет только воркер, удерживающий аренду "ingestion"
+leader = LeaderLease(
+    "ingestion",
+    on_elected=lambda: scheduler.start(parser_cities()),
+    on_lost=scheduler.stop,
+    on_heartbeat=leader_heartbeat,
+)
+
+async def sync_shared_state():
+    # Кэш отрисовки сбрасывается, когда парсер лидера записал новые посты
+    while True:
+        try:
+            render_cache.sync(int(await async_db.get_state(RENDER_GENERATION_KEY, 0)))
+        except Exception as e:
+            print(f"Ошибка синхронизации с другими воркерами: {e}")
+        await asyncio.sleep(SHARED_SYNC_INTERVAL)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    if RENDER_URL:
-        webhook_url = f"{RENDER_URL}/webhook/{WEBHOOK_URL}"
-        await bot.set_webhook(webhook_url)
-        print(f"✅ Webhook установлен: {webhook_url}")
-    else:
-        print("❌ Не задан RENDER_EXTERNAL_URL")
-    yield  # On shutdown logic можно добавить здесь
+    # Схема БД проверяется один раз при запуске, а не при импорте модулей
+    with startup.phase("init_db"):
+        await async_db.init_db()
+    with startup.phase("set_webhook"):
+        if RENDER_URL:
+            webhook_url = f"{RENDER_URL}/webhook/{WEBHOOK_URL}"
+            await bot.set_webhook(webhook_url)
+            print(f"✅ Webhook установлен: {webhook_url}")
+        else:
+            print("❌ Не задан RENDER_EXTERNAL_URL")
+    # Воркеры очереди обновлений; фоновое обновление городов — у выбранного лидера
+    with startup.phase("start workers"):
+        update_queue.start()
+        leader.start()
+        sync_task = asyncio.create_task(sync_shared_state())
+    startup.print_report()
+    yield
+    sync_task.cancel()
+    await update_queue.stop()
+    await leader.stop()
+    # Завершаем пул потоков БД
+    async_db.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -44,9 +135,15 @@ async def telegram_webhook(request: Request):
     try:
         data = await request.json()
         update = Update(**data)
-        await dp.feed_update(bot, update)
     except Exception as e:
+        # Некорректное обновление подтверждаем, чтобы Telegram не присылал его снова
         print(f"[!] Ошибка обработки webhook: {e}")
+        return {"status": "ok"}
+
+    # Обработка идёт в фоне; при переполненной очереди просим Telegram повторить позже
+    if not await update_queue.submit(update):
+        return Response(status_code=503)
+    startup.mark_first_webhook()
     return {"status": "ok"}
 
 @app.get("/")
@@ -58,23 +155,25 @@ def ping():
     return {"pong": True}
 
 @app.get("/run-parser")
-def run_parser_route():
-    try:
-        now = time.time()
-
-        # Проверка времени последнего запуска
-        if os.path.exists(LAST_RUN_FILE):
-            with open(LAST_RUN_FILE, "r") as f:
-                last_run = float(f.read().strip() or 0)
-            if now - last_run < MIN_INTERVAL_SECONDS:
-                return {"status": "Пропущено — парсер недавно запускался."}
-
-        # Обновляем метку времени
-        with open(LAST_RUN_FILE, "w") as f:
-            f.write(str(now))
-
-        # Запуск парсера в фоне
-        Thread(target=update_all_cities).start()
-        return {"status": "Парсинг запущен"}
-    except Exception as e:
-        return {"error": str(e)}
+async def run_parser_route():
+    # Только ставит города в очередь планировщика; запуск и ограничения — в scheduler.py
+    if not leader.is_leader:
+        await async_db.set_state(PARSER_REQUEST_KEY, str(int(time.time())))
+        return {"status": "Запрос передан ведущему воркеру"}
+    queued = scheduler.enqueue()
+    if not queued:
+        return {"status": "Пропущено — парсер недавно запускался."}
+    return {"status": "Парсинг запущен", "cities": queued}
+
+@app.get("/parser-status")
+async def parser_status():
+    return {**scheduler.status(), "leader": await leader.status()}
+
+@app.get("/startup")
+def startup_report():
+    return startup.report()
+
+@app.get("/metrics")
+def metrics_route():
+    # Текстовый формат Prometheus
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
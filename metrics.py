@@ -0,0 +1,156 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+# Границы корзин гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """
+    Монотонный счётчик с метками. inc() — одна короткая блокировка и запись в словарь.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = list(self.values.items())
+        for labels, value in sorted(items):
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами (кумулятивные значения считаются только при выводе).
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (+Inf последней), сумма]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, *labels):
+        """
+        Декоратор: измеряет время выполнения синхронной функции.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, *labels)
+            return wrapper
+        return decorator
+
+    def render(self):
+        with self.lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        for labels, counts, total in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+class Gauge:
+    """
+    Значение, которое читается функцией в момент запроса /metrics (например, глубина очереди).
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def render(self):
+        yield f"{self.name} {self.func()}"
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            # Повторная регистрация (например, при перезагрузке модуля) возвращает существующую метрику
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, func) -> Gauge:
+        with self.lock:
+            # Функцию значения можно переназначить (новый экземпляр очереди и т.п.)
+            metric = self.metrics[name] = Gauge(name, help, func)
+            return metric
+
+    def render(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus.
+        """
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                print(f"Ошибка сбора метрики {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# Метрики, общие для нескольких модулей
+vk_request_seconds = registry.histogram(
+    "vk_request_seconds", "Время HTTP-запроса к VK API", ("method",))
+vk_errors_total = registry.counter(
+    "vk_errors_total", "Ошибки VK API по кодам", ("method", "code"))
+db_query_seconds = registry.histogram(
+    "db_query_seconds", "Время выполнения функций database.py", ("function",))
+handler_seconds = registry.histogram(
+    "handler_seconds", "Время обработки обновления aiogram по типу", ("handler",))
+parser_posts_total = registry.counter(
+    "parser_posts_total", "Посты, обработанные парсером: accepted/rejected/skipped", ("city", "result"))
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter
+
+import async_db
+from formatting import trim_to_sentence
+
+# Лимиты Telegram: около 30 сообщений в секунду всего и 1 сообщение в секунду в один чат
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+PER_CHAT_INTERVAL = 1.0
+DIGEST_MAX_POSTS = 5
+SEND_ATTEMPTS = 3
+# Ключ app_state с общим курсором: последний favorite_posts.id, по которому рассылка завершена
+CURSOR_KEY = "notifications_last_post_row"
+
+class SendScheduler:
+    """
+    Асинхронный ограничитель отправки сообщений: общий token bucket
+    (GLOBAL_RATE сообщений в секунду) и не чаще раза в PER_CHAT_INTERVAL на чат.
+    """
+    def __init__(self, rate: float = GLOBAL_RATE, per_chat: float = PER_CHAT_INTERVAL):
+        self.rate = rate
+        self.per_chat = per_chat
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.chat_next: dict[int, float] = {}
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, chat_id: int):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = max((1 - self.tokens) / self.rate, self.chat_next.get(chat_id, 0) - now)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.tokens -= 1
+            self.chat_next[chat_id] = now + self.per_chat
+            # Не держим в памяти чаты, лимит которых уже истёк
+            if len(self.chat_next) > 10000:
+                self.chat_next = {c: t for c, t in self.chat_next.items() if t > now}
+
+def build_digest(posts) -> str:
+    """
+    Один текст на пользователя для всех его новых постов.
+    """
+    text = "🔔 Новые посты в сохранённых приютах:\n\n"
+    for _, post_url, post_text in posts[:DIGEST_MAX_POSTS]:
+        text += f"{trim_to_sentence(post_text or '', 200)}\n🔗 {post_url}\n\n"
+    if len(posts) > DIGEST_MAX_POSTS:
+        text += f"…и ещё {len(posts) - DIGEST_MAX_POSTS}"
+    return trim_to_sentence(text, 4000)
+
+class Notifier:
+    """
+    Рассылает подписчикам дайджесты новых постов из favorite_posts.
+    Курсоры доставки хранятся в БД, поэтому после перезапуска ничего не отправляется повторно.
+    """
+    def __init__(self, bot, sender: SendScheduler = None):
+        self.bot = bot
+        self.sender = sender or SendScheduler()
+        self.lock = asyncio.Lock()
+
+    async def run_once(self) -> int:
+        async with self.lock:
+            cursor = await async_db.get_state(CURSOR_KEY)
+            if cursor is None:
+                # Первый запуск: не рассылаем накопленную историю
+                latest = await async_db.get_max_favorite_post_row()
+                await async_db.set_state(CURSOR_KEY, str(latest))
+                return 0
+            cursor = int(cursor)
+
+            rows = await async_db.get_pending_notifications(cursor)
+            digests: dict[int, list] = {}
+            for user_id, row_id, post_url, text in rows:
+                posts = digests.setdefault(user_id, [])
+                # Один пост стены может быть сохранён для нескольких приютов пользователя
+                if all(post[1] != post_url for post in posts):
+                    posts.append((row_id, post_url, text))
+
+            sent = 0
+            # Общий курсор не обгоняет посты пользователей, которым доставка не удалась временно
+            latest = max((row[1] for row in rows), default=cursor)
+            for user_id, posts in digests.items():
+                delivered = await self._deliver(user_id, build_digest(posts))
+                if delivered is None:
+                    latest = min(latest, posts[0][0] - 1)
+                    continue
+                if delivered:
+                    sent += 1
+                await async_db.set_notification_cursor(user_id, posts[-1][0])
+
+            if latest > cursor:
+                await async_db.set_state(CURSOR_KEY, str(latest))
+            if sent:
+                print(f"🔔 Отправлено уведомлений: {sent}")
+            return sent
+
+    async def _deliver(self, chat_id: int, text: str):
+        """
+        True — отправлено, False — постоянная ошибка (повторять не нужно),
+        None — временная ошибка: посты останутся в очереди до следующей рассылки.
+        """
+        for _ in range(SEND_ATTEMPTS):
+            await self.sender.acquire(chat_id)
+            try:
+                await self.bot.send_message(chat_id, text, disable_web_page_preview=True)
+                return True
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Пользователь заблокировал бота или чат недоступен — не повторяем
+                print(f"Не удалось отправить уведомление {chat_id}: {e}")
+                return False
+            except Exception as e:
+                print(f"Ошибка отправки уведомления {chat_id}: {e}")
+                return None
+        return None
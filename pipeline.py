@@ -0,0 +1,271 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from metrics import registry
+
+# Между стадиями передаются пачки постов (обычно страница выдачи VK);
+# очередь ограничена, поэтому быстрая стадия ждёт медленную
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+SCORE_WORKERS = int(os.getenv("PIPELINE_SCORE_WORKERS", "2"))
+# Оценка в отдельных процессах (0 — в потоках стадии score)
+SCORE_PROCESSES = int(os.getenv("PIPELINE_SCORE_PROCESSES", "0"))
+PIPELINE_SINK = os.getenv("PIPELINE_SINK", "sqlite")  # sqlite | jsonl | dry-run
+PIPELINE_JSONL_PATH = os.getenv("PIPELINE_JSONL_PATH", "shelters.jsonl")
+
+pipeline_items_total = registry.counter(
+    "pipeline_items_total", "Посты, прошедшие через стадии конвейера", ("stage", "direction"))
+
+_DONE = object()
+
+class Stage:
+    """
+    Стадия конвейера: func(пачка) -> пачка (или пустой список), выполняется в workers потоках.
+    Считает входящие и исходящие посты и время работы.
+    """
+    def __init__(self, name: str, func=None, workers: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.items_in = 0
+        self.items_out = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, items_in: int, items_out: int, elapsed: float):
+        with self.lock:
+            self.items_in += items_in
+            self.items_out += items_out
+            self.busy += elapsed
+        pipeline_items_total.inc(self.name, "in", amount=items_in)
+        pipeline_items_total.inc(self.name, "out", amount=items_out)
+
+    def process(self, batch: list) -> list:
+        started = time.perf_counter()
+        out = self.func(batch) or []
+        self.record(len(batch), len(out), time.perf_counter() - started)
+        return out
+
+    def stats(self, elapsed: float) -> dict:
+        return {
+            "in": self.items_in,
+            "out": self.items_out,
+            "busy_seconds": round(self.busy, 3),
+            "per_sec": round(self.items_in / elapsed, 1) if elapsed else None,
+        }
+
+class Pipeline:
+    """
+    Конвейер source -> стадии -> sink на потоках, связанных ограниченными очередями.
+    source — итерируемый объект, выдающий пачки; источник читается в вызывающем потоке.
+    stop() (например, sink при достижении лимита) останавливает чтение источника,
+    а уже поставленные в очереди пачки отбрасываются.
+    """
+    def __init__(self, source, stages: list, sink, queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.source = source
+        self.sink = sink
+        self.source_stage = Stage("source")
+        self.stages = list(stages) + [Stage(f"sink:{sink.name}", sink.write)]
+        self.queue_size = queue_size
+        self.stop_event = threading.Event()
+        self.errors = []
+        self.lock = threading.Lock()
+        sink.on_limit = self.stop
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self) -> dict:
+        """
+        Прогоняет весь источник через конвейер. Возвращает статистику по стадиям.
+        """
+        started = time.perf_counter()
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        threads = []
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            downstream = self.stages[i + 1].workers if outbox else 0
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker, args=(stage, queues[i], outbox, downstream, remaining),
+                    name=f"pipeline-{stage.name}", daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        try:
+            iterator = iter(self.source)
+            while not self.stop_event.is_set():
+                fetch_started = time.perf_counter()
+                batch = next(iterator, None)
+                if batch is None:
+                    break
+                self.source_stage.record(len(batch), len(batch), time.perf_counter() - fetch_started)
+                if batch:
+                    queues[0].put(batch)
+        except Exception as e:
+            print(f"Ошибка источника конвейера: {e}")
+            self.errors.append(f"source: {e}")
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_DONE)
+            for thread in threads:
+                thread.join()
+            self.sink.close()
+
+        elapsed = time.perf_counter() - started
+        stats = {"seconds": round(elapsed, 3), "errors": list(self.errors), "stages": {}}
+        for stage in [self.source_stage] + self.stages:
+            stats["stages"][stage.name] = stage.stats(elapsed)
+        return stats
+
+    def _worker(self, stage: Stage, inbox: queue.Queue, outbox, downstream: int, remaining: list):
+        while True:
+            batch = inbox.get()
+            if batch is _DONE:
+                break
+            if self.stop_event.is_set():
+                # Конвейер остановлен — только разбираем очередь, чтобы не блокировать соседей
+                continue
+            try:
+                out = stage.process(batch)
+            except Exception as e:
+                print(f"Ошибка стадии {stage.name}: {e}")
+                with self.lock:
+                    self.errors.append(f"{stage.name}: {e}")
+                self.stop()
+                continue
+            if out and outbox is not None:
+                outbox.put(out)
+        # Последний завершившийся поток стадии передаёт сигнал завершения дальше
+        with self.lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and outbox is not None:
+            for _ in range(downstream):
+                outbox.put(_DONE)
+
+class Sink:
+    """
+    Базовый приёмник: ограничивает число записанных постов (limit) и
+    сообщает конвейеру о достижении лимита через on_limit.
+    """
+    name = "sink"
+
+    def __init__(self, limit: int = None):
+        self.limit = limit
+        self.written = 0
+        self.on_limit = None
+        self.lock = threading.Lock()
+
+    def write(self, batch: list) -> list:
+        with self.lock:
+            if self.limit is not None:
+                batch = batch[:max(0, self.limit - self.written)]
+            if batch:
+                self._write(batch)
+                self.written += len(batch)
+            reached = self.limit is not None and self.written >= self.limit
+        if reached and self.on_limit:
+            self.on_limit()
+        return batch
+
+    def _write(self, batch: list):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class SQLiteSink(Sink):
+    """
+    Сохраняет пачку в shelters одной транзакцией и отмечает посты обработанными.
+    to_row превращает пост в строку для database.add_shelters; after_write вызывается
+    с сохранёнными строками (сброс кэша отрисовки и т.п.).
+    """
+    name = "sqlite"
+
+    def __init__(self, to_row, seen, limit: int = None, after_write=None):
+        super().__init__(limit)
+        self.to_row = to_row
+        self.seen = seen
+        self.after_write = after_write
+
+    def _write(self, batch: list):
+        from database import add_shelters
+        rows = [self.to_row(post) for post in batch]
+        add_shelters(rows)
+        for post in batch:
+            self.seen.add(post["key"])
+        self.seen.flush()
+        if self.after_write:
+            self.after_write(rows)
+
+class JSONLSink(Sink):
+    """
+    Дописывает посты в JSONL-файл (по одному JSON-объекту на строку), например для выгрузки
+    или повторной обработки; посты отмечаются обработанными, как и при записи в БД.
+    """
+    name = "jsonl"
+
+    def __init__(self, path: str, seen, limit: int = None):
+        super().__init__(limit)
+        self.path = path
+        self.seen = seen
+        self.file = None
+
+    def _write(self, batch: list):
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+        for post in batch:
+            self.file.write(json.dumps(post, ensure_ascii=False) + "\n")
+            self.seen.add(post["key"])
+        self.file.flush()
+        self.seen.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+class DryRunSink(Sink):
+    """
+    Только считает посты, которые были бы сохранены; ничего не пишет.
+    """
+    name = "dry-run"
+
+    def _write(self, batch: list):
+        pass
+
+class DryRunSeen:
+    """
+    Обёртка над хранилищем обработанных постов для пробного прогона:
+    читает общий кэш, но новые отметки держит только в памяти.
+    """
+    def __init__(self, base):
+        self.base = base
+        self.added = set()
+
+    def __contains__(self, key) -> bool:
+        return key in self.added or key in self.base
+
+    def add(self, key):
+        self.added.add(key)
+
+    def flush(self):
+        pass
+
+def create_sink(seen, to_row, limit: int = None, after_write=None, kind: str = PIPELINE_SINK):
+    """
+    Выбирает приёмник по PIPELINE_SINK. Возвращает (sink, хранилище отметок для стадий):
+    в режиме dry-run отметки об обработке не сохраняются.
+    """
+    if kind == "jsonl":
+        return JSONLSink(PIPELINE_JSONL_PATH, seen, limit), seen
+    if kind == "dry-run":
+        return DryRunSink(limit), DryRunSeen(seen)
+    if kind != "sqlite":
+        print(f"Неизвестный PIPELINE_SINK={kind}, используется sqlite")
+    return SQLiteSink(to_row, seen, limit, after_write), seen
@@ -0,0 +1,65 @@
+import os
+import threading
+from collections import OrderedDict
+
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "2000"))
+# Ключ app_state со счётчиком записей парсера (общий для всех процессов)
+RENDER_GENERATION_KEY = "render_generation"
+
+class RenderCache:
+    """
+    Кэш готовых к отправке сообщений (текст и клавиатура) для списков приютов
+    по городу и для карточек приютов. Данные меняются только при записи
+    парсером, поэтому записи сбрасываются из vk_parser после сохранения постов.
+    Потокобезопасен: сброс вызывается из потока парсера.
+    """
+    def __init__(self, max_size: int = RENDER_CACHE_SIZE):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        # Номер поколения данных (целое из app_state), по которому сбрасываются кэши других процессов
+        self.generation = None
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def invalidate_city(self, city: str):
+        with self.lock:
+            for key in [k for k in self.data if k[0] == "city" and k[1] == city]:
+                del self.data[key]
+
+    def invalidate_shelters(self, shelter_ids):
+        with self.lock:
+            for shelter_id in shelter_ids:
+                self.data.pop(("shelter", shelter_id), None)
+
+    def sync(self, generation: int, own: bool = False):
+        """
+        Сбрасывает весь кэш, если другой процесс записал новые посты
+        (поколение в общей базе выросло). own=True — поколение только что увеличил
+        этот процесс: свои записи он уже сбросил точечно, и полный сброс нужен,
+        только если между ними вклинилась запись другого процесса.
+        Устаревшие (меньшие) поколения игнорируются.
+        """
+        with self.lock:
+            if self.generation is None:
+                self.generation = generation
+                return
+            if generation <= self.generation:
+                return
+            if not (own and generation == self.generation + 1):
+                self.data.clear()
+            self.generation = generation
+
+render_cache = RenderCache()
@@ -1,14 +1,23 @@
-from vk_parser import search_vk_groups
 from database import init_db
 
+# Точки входа парсинга для scheduler.py; vk_parser (а с ним requests) импортируется
+# при первом запуске: main.py импортирует отсюда только CITIES
 CITIES = ["Новосибирск"]  # Можно менять
 
-def update_all_cities():
-    print("🚀 Запуск обновления приютов и избранных постов")
+def prepare():
+    from vk_parser import parsed_posts
     init_db()
+    # Удаляем устаревшие отметки / ротируем фильтр обработанных постов
+    parsed_posts.expire()
 
-    for city in CITIES:
+def update_city(city):
+    from leader import exclusive
+    from vk_parser import search_vk_groups
+    # Та же аренда, что и у разбора по запросу пользователя (bot.parse_city):
+    # город не разбирается двумя потоками или процессами одновременно
+    with exclusive(f"parse:{city}") as owner:
+        if not owner:
+            print(f"⏭ Город {city} только что обновил другой поток или процесс")
+            return
         print(f"🔄 Обновление города: {city}")
         search_vk_groups(city)
-
-    print("✅ Все обновления завершены.")
@@ -0,0 +1,240 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime
+
+# Периодичность обновления каждого города и разброс, чтобы города не обновлялись одновременно
+REFRESH_INTERVAL = int(os.getenv("PARSER_INTERVAL", str(60 * 60)))
+REFRESH_JITTER = float(os.getenv("PARSER_JITTER", "0.1"))  # доля от интервала
+# Не запускать город повторно чаще, чем раз в MIN_INTERVAL секунд (защита /run-parser)
+MIN_INTERVAL = 60 * 30
+MAX_PARALLEL = int(os.getenv("CITY_CONCURRENCY", "4"))
+# Как часто проверять стены групп из избранного
+FAVORITES_INTERVAL = int(os.getenv("FAVORITES_INTERVAL", str(15 * 60)))
+VIEWS_WINDOW = 60 * 60  # просмотры за последний час определяют приоритет
+TICK = 30  # как часто проверять расписание, с
+
+class CityState:
+    def __init__(self, next_run: float):
+        self.next_run = next_run
+        self.requested = False
+        self.running = False
+        self.last_started = None
+        self.last_finished = None
+        self.last_error = None
+        self.views = deque()
+        # Город в расписании: из списка городов или с найденными приютами.
+        # Остальные города хранятся только ради счётчика просмотров
+        self.scheduled = False
+
+class IngestionScheduler:
+    """
+    Фоновый планировщик парсинга внутри процесса FastAPI.
+    Каждый город обновляется раз в REFRESH_INTERVAL (± jitter), не более одного
+    запуска на город одновременно; при нехватке слотов первыми идут города,
+    которые пользователи чаще открывали за последний час.
+    """
+    def __init__(self, interval: float = REFRESH_INTERVAL, jitter: float = REFRESH_JITTER,
+                 max_parallel: int = MAX_PARALLEL):
+        self.interval = interval
+        self.jitter = jitter
+        self.max_parallel = max_parallel
+        self.cities: dict[str, CityState] = {}
+        self.wake = asyncio.Event()
+        self.task = None
+        self.stopping = False
+        self.running_tasks = set()
+        self.last_maintenance = 0.0
+        self.favorites_task = None
+        self.favorites_next_run = 0.0
+        # Асинхронные функции, вызываемые после каждой проверки избранного (рассылка уведомлений)
+        self.favorites_hooks = []
+
+    def _next_time(self, now: float, first: bool = False) -> float:
+        if first:
+            # Первый запуск размазываем по первому интервалу
+            return now + random.uniform(0, self.interval * self.jitter)
+        spread = self.interval * self.jitter
+        return now + self.interval + random.uniform(-spread, spread)
+
+    def _state(self, city: str) -> CityState:
+        state = self.cities.get(city)
+        if state is None:
+            state = self.cities[city] = CityState(self._next_time(time.time()))
+        return state
+
+    def record_view(self, city: str):
+        """
+        Отмечает просмотр города пользователем (для приоритета обновления).
+        В расписание город попадает только через start() или track().
+        """
+        views = self._state(city).views
+        now = time.time()
+        views.append(now)
+        while views and views[0] < now - VIEWS_WINDOW:
+            views.popleft()
+
+    def track(self, city: str):
+        """
+        Добавляет в расписание город, по которому нашлись приюты.
+        """
+        self._state(city).scheduled = True
+
+    def _prune(self):
+        # Города вне расписания, которые давно не открывали, больше не нужны
+        for city, state in list(self.cities.items()):
+            if not state.scheduled and not state.running and not state.requested and not self.recent_views(city):
+                del self.cities[city]
+
+    def recent_views(self, city: str) -> int:
+        views = self.cities[city].views
+        cutoff = time.time() - VIEWS_WINDOW
+        while views and views[0] < cutoff:
+            views.popleft()
+        return len(views)
+
+    def enqueue(self, city: str = None) -> list:
+        """
+        Ставит город (или все города расписания) в очередь на ближайший запуск.
+        Возвращает список поставленных городов; недавно обновлённые и
+        уже выполняющиеся пропускаются.
+        """
+        now = time.time()
+        queued = []
+        names = [city] if city else [name for name, state in self.cities.items() if state.scheduled]
+        for name in names:
+            state = self._state(name)
+            if state.running or (state.last_started and now - state.last_started < MIN_INTERVAL):
+                continue
+            state.requested = True
+            queued.append(name)
+        self.wake.set()
+        return queued
+
+    def status(self) -> dict:
+        def fmt(ts):
+            return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts else None
+        return {
+            "cities": {
+                city: {
+                    "running": state.running,
+                    "requested": state.requested,
+                    "next_run": fmt(state.next_run),
+                    "last_started": fmt(state.last_started),
+                    "last_finished": fmt(state.last_finished),
+                    "last_error": state.last_error,
+                    "recent_views": self.recent_views(city),
+                }
+                for city, state in self.cities.items()
+            },
+            "favorites": {
+                "running": self.favorites_task is not None,
+                "next_run": fmt(self.favorites_next_run),
+            },
+        }
+
+    def start(self, cities=()):
+        now = time.time()
+        for city in cities:
+            self.cities.setdefault(city, CityState(self._next_time(now, first=True))).scheduled = True
+        if self.task is None:
+            self.stopping = False
+            self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task:
+            # Флаг нужен в дополнение к cancel(): wait_for в Python < 3.12 может
+            # проглотить отмену, если событие сработало одновременно с ней
+            self.stopping = True
+            self.wake.set()
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        # Потоки парсера прервать нельзя — дожидаемся текущих запусков
+        pending = list(self.running_tasks) + ([self.favorites_task] if self.favorites_task else [])
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _loop(self):
+        while not self.stopping:
+            now = time.time()
+            if now - self.last_maintenance >= self.interval:
+                self.last_maintenance = now
+                try:
+                    await asyncio.to_thread(_prepare)
+                except Exception as e:
+                    print(f"Ошибка подготовки парсера: {e}")
+                self._prune()
+
+            if now >= self.favorites_next_run and self.favorites_task is None:
+                self.favorites_task = asyncio.create_task(self._run_favorites())
+
+            due = [
+                city for city, state in self.cities.items()
+                if not state.running and (state.requested or (state.scheduled and state.next_run <= now))
+            ]
+            due.sort(key=lambda city: (not self.cities[city].requested, -self.recent_views(city)))
+            for city in due[:max(0, self.max_parallel - len(self.running_tasks))]:
+                if self.stopping:
+                    break
+                task = asyncio.create_task(self._run_city(city))
+                self.running_tasks.add(task)
+                task.add_done_callback(self.running_tasks.discard)
+
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=TICK)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_favorites(self):
+        try:
+            try:
+                await asyncio.to_thread(_poll_favorites)
+            except Exception as e:
+                print(f"Ошибка проверки избранных групп: {e}")
+            for hook in self.favorites_hooks:
+                try:
+                    await hook()
+                except Exception as e:
+                    print(f"Ошибка после проверки избранных групп: {e}")
+        finally:
+            self.favorites_next_run = time.time() + FAVORITES_INTERVAL
+            self.favorites_task = None
+
+    async def _run_city(self, city: str):
+        state = self.cities[city]
+        state.running = True
+        state.requested = False
+        state.last_started = time.time()
+        state.last_error = None
+        try:
+            await asyncio.to_thread(_update_city, city)
+        except Exception as e:
+            state.last_error = str(e)
+            print(f"Ошибка обновления города {city}: {e}")
+        finally:
+            state.running = False
+            state.last_finished = time.time()
+            state.next_run = self._next_time(state.last_finished)
+            self.wake.set()
+
+# Парсер импортируется при первом запуске, а не при импорте модуля
+def _prepare():
+    from run_parser import prepare
+    prepare()
+
+def _poll_favorites():
+    from favorites_watcher import poll_favorite_groups
+    poll_favorite_groups()
+
+def _update_city(city: str):
+    from run_parser import update_city
+    update_city(city)
+
+scheduler = IngestionScheduler()
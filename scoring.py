@@ -0,0 +1,234 @@
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_right
+from functools import lru_cache
+
+SENTENCE_DELIMITERS = re.compile(r"[.!?]")
+# Бонус, если два разных положительных слова встретились в одном предложении
+PAIR_BONUS = 3
+
+class KeywordScorer:
+    """
+    Оценка поста по ключевым словам за один проход по тексту.
+    Все фразы собираются в одно регулярное выражение (с заглядыванием вперёд,
+    чтобы находить и пересекающиеся вхождения), позиции совпадений
+    сопоставляются с номерами предложений.
+    Результат совпадает с прежним calculate_post_score.
+    """
+    def __init__(self, positive: dict, negative: dict):
+        self.positive = dict(positive)
+        self.negative = dict(negative)
+        phrases = sorted(set(self.positive) | set(self.negative), key=len, reverse=True)
+        # Самая длинная фраза, найденная в позиции, плюс все её префиксы из таблицы —
+        # это ровно все фразы, начинающиеся в этой позиции
+        self.pattern = re.compile("(?=(" + "|".join(map(re.escape, phrases)) + "))")
+        self.prefixes = {
+            phrase: [other for other in phrases if phrase.startswith(other)]
+            for phrase in phrases
+        }
+
+    def find(self, text: str) -> dict:
+        """
+        Возвращает {фраза: множество номеров предложений, где она встречается}.
+        """
+        if not self.prefixes:
+            return {}
+        text_lower = text.lower()
+        bounds = [m.start() for m in SENTENCE_DELIMITERS.finditer(text_lower)]
+        found = {}
+        for m in self.pattern.finditer(text_lower):
+            sentence = bisect_right(bounds, m.start())
+            for phrase in self.prefixes[m.group(1)]:
+                found.setdefault(phrase, set()).add(sentence)
+        return found
+
+    def score(self, text: str):
+        found = self.find(text)
+        score = 0
+        reasons = []
+
+        # Считаем положительные слова
+        for phrase, pts in self.positive.items():
+            if phrase in found:
+                score += pts
+                reasons.append(f"+{pts} '{phrase}'")
+
+        # Считаем отрицательные слова
+        for phrase, pts in self.negative.items():
+            if phrase in found:
+                score += pts
+                reasons.append(f"{pts} '{phrase}'")
+
+        # Дополнительная логика: если два положительных слова рядом (в одном предложении)
+        by_sentence = {}
+        for phrase in self.positive:
+            for sentence in found.get(phrase, ()):
+                by_sentence.setdefault(sentence, []).append(phrase)
+        for sentence in sorted(by_sentence):
+            if len(by_sentence[sentence]) >= 2:
+                score += PAIR_BONUS
+                reasons.append(f"+{PAIR_BONUS} за связку ключевых слов: {by_sentence[sentence]}")
+                break
+
+        return score, reasons
+
+    def score_batch(self, texts) -> list:
+        """
+        Оценивает сразу страницу постов: список пар (score, reasons).
+        """
+        return [self.score(text) for text in texts]
+
+
+# Окончания русских слов (от длинных к коротким) для упрощённого стемминга:
+# "приюту", "приюты" -> "приют", "кошкам" -> "кошк", "собаки" -> "собак"
+RU_ENDINGS = sorted("""
+    иями ями ами ого его ому ему ыми ими
+    ые ие ое ее ой ый ий ая яя ую юю ых их ым им ам ям ах ях ом ем ев ов ей ью ия ии ию
+    а я о е ы и у ю ь й
+""".split(), key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+TOKEN = re.compile(r"[.!?]|\w+")
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    word = word.replace("ё", "е")
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+@lru_cache(maxsize=4096)
+def normalize(text: str) -> tuple:
+    """
+    Нормализованный поток токенов поста: кортеж пар (основа слова, номер предложения).
+    Результат кэшируется, чтобы повторная оценка того же текста не разбирала его заново.
+    """
+    tokens = []
+    sentence = 0
+    for m in TOKEN.finditer(text.lower()):
+        word = m.group()
+        if word in ".!?":
+            sentence += 1
+        else:
+            tokens.append((stem(word), sentence))
+    return tuple(tokens)
+
+class StemmingScorer(KeywordScorer):
+    """
+    Вариант KeywordScorer, сравнивающий основы слов, а не подстроки:
+    находит словоформы ("приюту", "кошкам", "собак") за один проход по токенам.
+    Однословная фраза совпадает с любым словом, основа которого начинается с её основы
+    ("приютили", "приютить" -> "приют"), как и при поиске подстроки в KeywordScorer;
+    многословные фразы сравниваются по основам целиком.
+    """
+    def __init__(self, positive: dict, negative: dict):
+        super().__init__(positive, negative)
+        # Первая основа фразы -> [(фраза, основы всех её слов)]
+        self.by_first_stem = {}
+        # Основа однословной фразы -> [фраза]; длины этих основ для поиска по префиксу
+        self.by_stem_prefix = {}
+        for phrase in set(self.positive) | set(self.negative):
+            stems = tuple(s for s, _ in normalize(phrase))
+            if len(stems) == 1:
+                self.by_stem_prefix.setdefault(stems[0], []).append(phrase)
+            elif stems:
+                self.by_first_stem.setdefault(stems[0], []).append((phrase, stems))
+        self.prefix_lengths = sorted({len(base) for base in self.by_stem_prefix})
+
+    def find(self, text: str) -> dict:
+        tokens = normalize(text)
+        found = {}
+        for i, (token, sentence) in enumerate(tokens):
+            for length in self.prefix_lengths:
+                if length > len(token):
+                    break
+                for phrase in self.by_stem_prefix.get(token[:length], ()):
+                    found.setdefault(phrase, set()).add(sentence)
+            for phrase, stems in self.by_first_stem.get(token, ()):
+                window = tokens[i:i + len(stems)]
+                if len(window) == len(stems) and all(
+                    s == w and ws == sentence for s, (w, ws) in zip(stems, window)
+                ):
+                    found.setdefault(phrase, set()).add(sentence)
+        return found
+
+class ScoringRules:
+    """
+    Правила оценки постов: скомпилированный scorer и пороги.
+    """
+    def __init__(self, positive: dict, negative: dict, min_score: int, max_posts: int, stemming: bool):
+        self.positive = positive
+        self.negative = negative
+        self.min_score = min_score
+        self.max_posts = max_posts
+        self.stemming = stemming
+        scorer_cls = StemmingScorer if stemming else KeywordScorer
+        self.scorer = scorer_cls(positive, negative)
+
+@lru_cache(maxsize=8)
+def _worker_scorer(positive: tuple, negative: tuple, stemming: bool) -> KeywordScorer:
+    scorer_cls = StemmingScorer if stemming else KeywordScorer
+    return scorer_cls(dict(positive), dict(negative))
+
+def score_texts(positive: tuple, negative: tuple, stemming: bool, texts: list) -> list:
+    """
+    Оценка пачки текстов в процессе пула (ProcessPoolExecutor): правила передаются
+    кортежами, scorer собирается один раз на процесс для каждого набора правил.
+    """
+    return _worker_scorer(positive, negative, stemming).score_batch(texts)
+
+class RulesLoader:
+    """
+    Загружает правила из JSON-файла и перечитывает его при изменении
+    (проверка mtime не чаще раза в check_interval секунд), без перезапуска процесса.
+    Если файла нет или он некорректен — используются правила по умолчанию.
+    Ключевые слова из переменной VK_KEYWORDS добавляются как положительные с весом 1.
+    """
+    def __init__(self, path: str, defaults: dict, check_interval: float = 5.0):
+        self.path = path
+        self.defaults = defaults
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.rules = None
+        self.mtime = None
+        self.checked_at = 0.0
+
+    def _mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def _build(self) -> ScoringRules:
+        config = dict(self.defaults)
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    config.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Ошибка чтения правил {self.path}: {e}. Используются правила по умолчанию.")
+
+        positive = {k.lower(): v for k, v in config["positive"].items()}
+        for keyword in os.getenv("VK_KEYWORDS", "").split(","):
+            keyword = keyword.strip().lower()
+            if keyword:
+                positive.setdefault(keyword, 1)
+        negative = {k.lower(): v for k, v in config["negative"].items()}
+        return ScoringRules(positive, negative, config["min_score"], config["max_posts"], config["stemming"])
+
+    def get(self) -> ScoringRules:
+        now = time.monotonic()
+        if self.rules is not None and now - self.checked_at < self.check_interval:
+            return self.rules
+        with self.lock:
+            self.checked_at = now
+            mtime = self._mtime()
+            if self.rules is None or mtime != self.mtime:
+                self.rules = self._build()
+                if self.mtime is not None or mtime is not None:
+                    print(f"Правила оценки постов загружены из {self.path}")
+                self.mtime = mtime
+            return self.rules
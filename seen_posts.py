@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+import time
+
+import database
+
+# Сколько хранить отметки об обработанных постах (старые посты VK уже не вернёт в выдаче)
+SEEN_POSTS_TTL_DAYS = int(os.getenv("SEEN_POSTS_TTL_DAYS", "30"))
+# Старый JSON-кэш: переносится в таблицу seen_posts при первой загрузке
+LEGACY_CACHE_FILE = "parsed_posts.json"
+
+# Режим хранения: "sqlite" — точный, "bloom" — вероятностный с фиксированным объёмом памяти
+SEEN_POSTS_MODE = os.getenv("SEEN_POSTS_MODE", "sqlite")
+BLOOM_PATH = os.getenv("SEEN_POSTS_BLOOM_PATH", "seen_posts.bloom")
+BLOOM_CAPACITY = int(os.getenv("SEEN_POSTS_BLOOM_CAPACITY", "1000000"))
+BLOOM_FP_RATE = float(os.getenv("SEEN_POSTS_BLOOM_FP_RATE", "0.001"))
+# Запас при подгрузке чужих ключей: seen_at ставится при add(), а в БД ключ попадает при flush()
+SYNC_OVERLAP = 600
+
+class SeenPosts:
+    """
+    Хранилище обработанных постов: набор в памяти для проверок за O(1)
+    и таблица seen_posts в SQLite, куда дописываются только новые ключи.
+    Потокобезопасно: парсер по расписанию и разбор по запросу из бота
+    могут работать одновременно.
+    """
+    def __init__(self, ttl_days: int = SEEN_POSTS_TTL_DAYS):
+        self.ttl = ttl_days * 86400
+        self.keys = set()
+        self.pending = []
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.synced_at = 0
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            database.init_db()
+            self._import_legacy()
+            since = int(time.time()) - self.ttl
+            database.expire_seen_posts(since)
+            self.synced_at = int(time.time())
+            self.keys = set(database.load_seen_posts(since))
+            self.loaded = True
+
+    def sync(self):
+        """
+        Подгружает ключи, которые с прошлой синхронизации записали другие процессы
+        (несколько воркеров делят одну таблицу seen_posts).
+        """
+        if not self.loaded:
+            self.load()
+            return
+        now = int(time.time())
+        keys = database.load_seen_posts(self.synced_at - SYNC_OVERLAP)
+        with self.lock:
+            self.keys.update(keys)
+            self.synced_at = now
+
+    def _import_legacy(self):
+        if not os.path.exists(LEGACY_CACHE_FILE):
+            return
+        with open(LEGACY_CACHE_FILE, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        now = int(time.time())
+        database.add_seen_posts((key, now) for key in legacy)
+        os.replace(LEGACY_CACHE_FILE, LEGACY_CACHE_FILE + ".migrated")
+        print(f"Перенесено {len(legacy)} обработанных постов из {LEGACY_CACHE_FILE}")
+
+    def __contains__(self, key):
+        if not self.loaded:
+            self.load()
+        return key in self.keys
+
+    def add(self, key):
+        if not self.loaded:
+            self.load()
+        with self.lock:
+            if key in self.keys:
+                return
+            self.keys.add(key)
+            self.pending.append((key, int(time.time())))
+
+    def flush(self):
+        """
+        Сохраняет новые ключи в БД одной транзакцией.
+        """
+        with self.lock:
+            rows, self.pending = self.pending, []
+        if rows:
+            database.add_seen_posts(rows)
+
+    def expire(self):
+        """
+        Удаляет устаревшие отметки из БД и из памяти.
+        """
+        self.flush()
+        since = int(time.time()) - self.ttl
+        removed = database.expire_seen_posts(since)
+        if removed:
+            fresh = set(database.load_seen_posts(since))
+            with self.lock:
+                self.keys = fresh | {key for key, _ in self.pending}
+        return removed
+
+def create_seen_posts():
+    """
+    Создаёт хранилище обработанных постов согласно SEEN_POSTS_MODE.
+    """
+    if SEEN_POSTS_MODE == "bloom":
+        from bloom import BloomSeenPosts
+        return BloomSeenPosts(BLOOM_PATH, BLOOM_CAPACITY, BLOOM_FP_RATE, SEEN_POSTS_TTL_DAYS * 86400)
+    return SeenPosts()
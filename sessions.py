@@ -0,0 +1,73 @@
+import os
+import time
+from collections import OrderedDict
+
+import async_db
+import database
+from leader import multiple_workers
+
+# Состояние пользователя хранится компактно: город, chat_id и message_id
+# последнего сообщения бота (а не весь объект aiogram Message) и последний запрос /search
+SESSION_FIELDS = ("city", "chat_id", "message_id", "search_query")
+# При нескольких воркерах uvicorn сессии должны быть общими (пустое значение — выбор по числу воркеров)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND") or ("sqlite" if multiple_workers() else "memory")
+SESSION_MAX_SIZE = int(os.getenv("SESSION_MAX_SIZE", "10000"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 86400)))
+
+class MemorySessionStore:
+    """
+    Хранилище сессий в памяти процесса с вытеснением LRU и сроком жизни TTL.
+    """
+    def __init__(self, max_size: int = SESSION_MAX_SIZE, ttl: float = SESSION_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data: OrderedDict[int, tuple[dict, float]] = OrderedDict()
+
+    async def get(self, user_id: int) -> dict:
+        entry = self.data.get(user_id)
+        if entry is None:
+            return {}
+        fields, expires = entry
+        if expires < time.monotonic():
+            del self.data[user_id]
+            return {}
+        self.data.move_to_end(user_id)
+        return dict(fields)
+
+    async def update(self, user_id: int, **fields):
+        current = await self.get(user_id)
+        current.update(fields)
+        self.data[user_id] = (current, time.monotonic() + self.ttl)
+        self.data.move_to_end(user_id)
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+class SQLiteSessionStore:
+    """
+    Хранилище сессий в таблице sessions: переживает перезапуск и общее
+    для нескольких процессов. Просроченные записи удаляются раз в cleanup_every записей.
+    """
+    def __init__(self, ttl: float = SESSION_TTL, cleanup_every: int = 1000):
+        self.ttl = ttl
+        self.cleanup_every = cleanup_every
+        self.writes = 0
+
+    async def get(self, user_id: int) -> dict:
+        row = await async_db.run_db(database.get_session, user_id, int(time.time()) - self.ttl)
+        if row is None:
+            return {}
+        return {name: value for name, value in zip(SESSION_FIELDS, row) if value is not None}
+
+    async def update(self, user_id: int, **fields):
+        await async_db.run_db(database.update_session, user_id, fields, int(time.time()))
+        self.writes += 1
+        if self.writes % self.cleanup_every == 0:
+            await async_db.run_db(database.expire_sessions, int(time.time()) - self.ttl)
+
+def create_session_store():
+    """
+    Создаёт хранилище сессий согласно SESSION_BACKEND ("memory" или "sqlite").
+    """
+    if SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore()
+    return MemorySessionStore()
@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом: первый запускает
+    задачу, остальные ждут её завершения и получают тот же результат.
+    """
+    def __init__(self):
+        self.inflight: dict[str, asyncio.Task] = {}
+
+    async def run(self, key: str, factory):
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # shield: отмена одного ожидающего не прерывает общую задачу
+        return await asyncio.shield(task)
+
+    def is_running(self, key: str) -> bool:
+        return key in self.inflight
+
+class NegativeCache:
+    """
+    Запоминает ключи без результата на ttl секунд.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.expires: dict[str, float] = {}
+
+    def add(self, key: str):
+        self.expires[key] = time.monotonic() + self.ttl
+
+    def discard(self, key: str):
+        self.expires.pop(key, None)
+
+    def __contains__(self, key: str) -> bool:
+        expires = self.expires.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self.expires[key]
+            return False
+        return True
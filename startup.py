@@ -0,0 +1,39 @@
+import time
+from contextlib import contextmanager
+
+# Время импорта этого модуля считается началом запуска процесса (main.py импортирует его первым)
+STARTED = time.perf_counter()
+
+# Этапы запуска по порядку: (название, секунды)
+phases = []
+first_webhook = None
+
+@contextmanager
+def phase(name: str):
+    """
+    Замеряет этап запуска: импорт группы модулей или шаг инициализации.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases.append((name, time.perf_counter() - started))
+
+def mark_first_webhook():
+    global first_webhook
+    if first_webhook is None:
+        first_webhook = time.perf_counter() - STARTED
+        print(f"⏱ Первый ответ на webhook через {first_webhook:.2f} с после запуска")
+
+def report() -> dict:
+    return {
+        "phases": {name: round(seconds, 4) for name, seconds in phases},
+        "total_seconds": round(sum(seconds for _, seconds in phases), 4),
+        "first_webhook_seconds": round(first_webhook, 4) if first_webhook is not None else None,
+    }
+
+def print_report():
+    print("⏱ Время запуска по этапам:")
+    for name, seconds in sorted(phases, key=lambda item: item[1], reverse=True):
+        print(f"   {seconds * 1000:8.1f} мс  {name}")
+    print(f"   {sum(seconds for _, seconds in phases) * 1000:8.1f} мс  всего")
@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import leader
+
+class ExclusiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_path = database.DB_PATH
+        database.DB_PATH = os.path.join(self.tmp.name, "shelters.db")
+        database.init_db()
+
+    def tearDown(self):
+        database.close_connection()
+        database.DB_PATH = self.old_path
+        self.tmp.cleanup()
+
+    def test_two_threads_of_one_process(self):
+        # Второй поток того же процесса не должен стать владельцем, пока работает первый
+        owners = []
+        lease_during_work = []
+        first_started = threading.Event()
+
+        def work(delay):
+            with leader.exclusive("parse:X", poll=0.05) as owner:
+                owners.append(owner)
+                if owner:
+                    first_started.set()
+                    time.sleep(delay)
+                    lease_during_work.append(database.get_lease("parse:X"))
+            database.close_connection()
+
+        first = threading.Thread(target=work, args=(0.5,))
+        first.start()
+        first_started.wait(5)
+        second = threading.Thread(target=work, args=(0.5,))
+        second.start()
+        first.join()
+        second.join()
+
+        self.assertEqual(sorted(owners), [False, True])
+        self.assertIsNotNone(lease_during_work[0])
+        self.assertIsNone(database.get_lease("parse:X"))
+
+if __name__ == "__main__":
+    unittest.main()
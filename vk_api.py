@@ -0,0 +1,196 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from metrics import vk_errors_total, vk_request_seconds
+
+load_dotenv()
+
+VK_TOKEN = os.getenv("VK_TOKEN")
+VK_API_VERSION = "5.199"
+VK_API_URL = os.getenv("VK_API_URL", "https://api.vk.com/method/")  # переопределяется для локальной заглушки (bench/)
+
+# Квота VK: 3 запроса в секунду для пользовательского токена
+# (для сервисного/группового токена можно поднять через VK_RPS)
+VK_RPS = float(os.getenv("VK_RPS", "3"))
+HTTP_POOL_SIZE = int(os.getenv("VK_HTTP_POOL", "10"))
+REQUEST_TIMEOUT = 15
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5  # секунды, удваивается с каждой попыткой
+
+# Коды ошибок VK, после которых имеет смысл повторить запрос:
+# 6 — слишком много запросов в секунду, 9 — flood control,
+# 10 — внутренняя ошибка сервера, 29 — достигнут лимит вызовов метода
+RETRY_ERROR_CODES = {6, 9, 10, 29}
+
+# Метод execute объединяет до 25 вызовов API в одном HTTP-запросе
+EXECUTE_MAX_CALLS = 25
+BATCH_WINDOW = float(os.getenv("VK_BATCH_WINDOW", "0.05"))  # сколько ждать попутных вызовов, с
+
+class VKError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"VK API error {code}: {message}")
+        self.code = code
+        self.message = message
+
+class TokenBucket:
+    """
+    Потокобезопасный ограничитель частоты запросов (token bucket).
+    rate — число токенов в секунду, capacity — максимальный «запас».
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Общая HTTP-сессия с пулом соединений и общий лимитер на токен
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+limiter = TokenBucket(VK_RPS)
+
+def _request(method: str, params: dict) -> dict:
+    """
+    Выполняет HTTP-запрос к VK API и возвращает JSON-ответ целиком.
+    Соблюдает квоту через limiter и повторяет запрос с экспоненциальной
+    задержкой при ошибках частоты запросов. Прочие ошибки — VKError.
+    """
+    params = dict(params)
+    params.setdefault("access_token", VK_TOKEN)
+    params.setdefault("v", VK_API_VERSION)
+
+    for attempt in range(MAX_RETRIES):
+        limiter.acquire()
+        started = time.perf_counter()
+        try:
+            data = session.post(VK_API_URL + method, data=params, timeout=REQUEST_TIMEOUT).json()
+        except Exception:
+            vk_errors_total.inc(method, "http")
+            raise
+        finally:
+            vk_request_seconds.observe(time.perf_counter() - started, method)
+        error = data.get("error")
+        if not error:
+            return data
+
+        code = error.get("error_code")
+        vk_errors_total.inc(method, code)
+        if code in RETRY_ERROR_CODES and attempt < MAX_RETRIES - 1:
+            delay = BACKOFF_BASE * (2 ** attempt) + random.uniform(0, BACKOFF_BASE)
+            print(f"VK API {method}: ошибка {code}, повтор через {delay:.1f} с")
+            time.sleep(delay)
+            continue
+        raise VKError(code, error.get("error_msg"))
+
+def call(method: str, **params):
+    """
+    Вызывает метод VK API и возвращает поле response.
+    """
+    return _request(method, params).get("response", {})
+
+def build_execute_code(calls) -> str:
+    """
+    Собирает VKScript для execute из списка пар (method, params).
+    """
+    parts = [f"API.{method}({json.dumps(params, ensure_ascii=False)})" for method, params in calls]
+    return "return [" + ",".join(parts) + "];"
+
+def execute(calls) -> list:
+    """
+    Выполняет до 25 вызовов одним запросом execute.
+    Возвращает список той же длины: результат вызова либо VKError,
+    если конкретный вызов внутри execute завершился ошибкой.
+    """
+    if len(calls) > EXECUTE_MAX_CALLS:
+        raise ValueError(f"execute принимает не более {EXECUTE_MAX_CALLS} вызовов")
+
+    data = _request("execute", {"code": build_execute_code(calls)})
+    results = data.get("response") or []
+    # Неудачные вызовы возвращают false, их ошибки перечислены по порядку в execute_errors
+    errors = iter(data.get("execute_errors", []))
+    out = []
+    for i, (method, _) in enumerate(calls):
+        result = results[i] if i < len(results) else False
+        if result is False:
+            err = next(errors, {})
+            vk_errors_total.inc(method, err.get("error_code"))
+            out.append(VKError(err.get("error_code"), err.get("error_msg", f"{method} не выполнен в execute")))
+        else:
+            out.append(result)
+    return out
+
+class ExecuteBatcher:
+    """
+    Собирает вызовы API из разных потоков (страницы, города) и отправляет
+    их пачками по 25 через execute. submit() сразу возвращает Future.
+    """
+    def __init__(self, window: float = BATCH_WINDOW, max_calls: int = EXECUTE_MAX_CALLS, workers: int = 3):
+        self.window = window
+        self.max_calls = max_calls
+        self.pending = []
+        self.cond = threading.Condition()
+        self.thread = None
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vk-execute")
+
+    def submit(self, method: str, **params) -> Future:
+        future = Future()
+        with self.cond:
+            self.pending.append((method, params, future))
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="vk-batcher", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                # Ждём попутные вызовы, пока не наберётся полная пачка или не истечёт окно
+                deadline = time.monotonic() + self.window
+                while len(self.pending) < self.max_calls:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch = self.pending[:self.max_calls]
+                del self.pending[:self.max_calls]
+            self.pool.submit(self._flush, batch)
+
+    def _flush(self, batch):
+        try:
+            results = execute([(method, params) for method, params, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future), result in zip(batch, results):
+            if isinstance(result, VKError):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+batcher = ExecuteBatcher()
@@ -1,16 +1,17 @@
-import requests
-import re
-import time
-import json
 import os
+import time
 from datetime import datetime
-from dotenv import load_dotenv
 
-load_dotenv()
+from concurrent.futures import ProcessPoolExecutor
 
-VK_TOKEN = os.getenv("VK_TOKEN")
-VK_API_VERSION = "5.199"
-CACHE_FILE = "parsed_posts.json"
+import vk_api
+from database import get_city_last_run, increment_state, init_db, set_city_last_run
+from metrics import parser_posts_total
+from pipeline import PIPELINE_SINK, SCORE_PROCESSES, SCORE_WORKERS, Pipeline, Stage, create_sink
+from render_cache import RENDER_GENERATION_KEY, render_cache
+from run_parser import CITIES
+from scoring import RulesLoader, score_texts
+from seen_posts import create_seen_posts
 
 # Настройка ключевых слов и баллов
 POSITIVE_KEYWORDS = {
@@ -34,126 +35,278 @@ NEGATIVE_KEYWORDS = {
 MIN_SCORE_THRESHOLD = 2  # Минимальный балл для публикации поста
 MAX_POSTS = 10
 
-# Кэшируем обработанные посты по id
-if os.path.exists(CACHE_FILE):
-    with open(CACHE_FILE, "r", encoding="utf-8") as f:
-        parsed_posts = set(json.load(f))
-else:
-    parsed_posts = set()
-
-def save_cache():
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(list(parsed_posts), f)
-
-def calculate_post_score(text):
-    text_lower = text.lower()
-    score = 0
-    reasons = []
-
-    # Считаем положительные слова
-    for phrase, pts in POSITIVE_KEYWORDS.items():
-        if phrase in text_lower:
-            score += pts
-            reasons.append(f"+{pts} '{phrase}'")
-
-    # Считаем отрицательные слова
-    for phrase, pts in NEGATIVE_KEYWORDS.items():
-        if phrase in text_lower:
-            score += pts
-            reasons.append(f"{pts} '{phrase}'")
-
-    # Дополнительная логика: если два положительных слова рядом (в одном предложении) + 3 балла
-    sentences = re.split(r'[.!?]', text_lower)
-    for sentence in sentences:
-        found = [kw for kw in POSITIVE_KEYWORDS if kw in sentence]
-        if len(found) >= 2:
-            score += 3
-            reasons.append(f"+3 за связку ключевых слов: {found}")
-            break
-
-    return score, reasons
-
-def add_shelter(post_id, group_name, group_url, city_name, post_info_json):
-    # Заглушка для функции сохранения в базу или файл
-    # TODO: заменить на реальное сохранение
-    print(f"Сохраняем пост {post_id} из группы '{group_name}' ({group_url}) для города {city_name}")
-
-def search_vk_groups(city_name):
-    print(f"\n🔍 Начинаем поиск постов для города: {city_name}")
+# Планирование запросов: вместо пустого q ищем "<город> <ключевое слово>"
+QUERY_KEYWORDS = int(os.getenv("VK_QUERY_KEYWORDS", "5"))  # сколько самых весомых слов превращать в запросы
+MAX_PAGES_PER_QUERY = int(os.getenv("VK_MAX_PAGES_PER_QUERY", "5"))
+COUNT_PER_REQUEST = 50
+FIRST_RUN_DAYS = 30  # глубина поиска, если город ещё ни разу не обновлялся
+RUN_OVERLAP_SECONDS = 3600  # перекрытие с прошлым запуском: VK индексирует посты с задержкой
+# Координаты городов для гео-запросов (latitude/longitude в newsfeed.search)
+CITY_COORDS = {
+    "Новосибирск": (55.0084, 82.9357),
+}
 
-    total_added = 0
-    offset = 0
-    count_per_request = 20
-
-    while total_added < MAX_POSTS:
-        url = "https://api.vk.com/method/newsfeed.search"
-        params = {
-            "access_token": VK_TOKEN,
-            "q": "",  # пустой запрос - все посты, фильтровать в коде
-            "count": count_per_request,
-            "offset": offset,
-            "v": VK_API_VERSION,
-            "extended": 1,
-            "fields": "city,description",
-            "filters": "post"
-        }
-
-        try:
-            response = requests.get(url, params=params).json()
-            if 'error' in response:
-                print(f"Ошибка VK API: {response['error'].get('error_msg')}")
-                break
-
-            items = response.get('response', {}).get('items', [])
-            if not items:
-                print("Постов не найдено, завершаем.")
-                break
-
-            for post in items:
-                post_id = post['post_id'] if 'post_id' in post else post['id']
-                owner_id = post['source_id']
-                text = post.get('text', '')
-                date = datetime.fromtimestamp(post['date']).strftime("%d.%m.%Y")
-
-                # Проверяем кэш
-                unique_post_id = f"{owner_id}_{post_id}"
-                if unique_post_id in parsed_posts:
-                    print(f"Пропускаем уже обработанный пост {unique_post_id}")
-                    continue
+# Правила оценки читаются из SCORING_RULES_FILE и перечитываются при его изменении;
+# константы выше — значения по умолчанию
+SCORING_RULES_FILE = os.getenv("SCORING_RULES_FILE", "scoring_rules.json")
+rules = RulesLoader(SCORING_RULES_FILE, {
+    "positive": POSITIVE_KEYWORDS,
+    "negative": NEGATIVE_KEYWORDS,
+    "min_score": MIN_SCORE_THRESHOLD,
+    "max_posts": MAX_POSTS,
+    "stemming": True,
+})
+
+# Кэшируем обработанные посты по id (таблица seen_posts или фильтр Блума, см. seen_posts.py);
+# загружаются при первом обращении, а не при импорте
+parsed_posts = create_seen_posts()
 
-                # Проверка по городу: пробуем найти название города в тексте или комментариях
-                city_lower = city_name.lower()
-                if city_lower not in text.lower():
-                    # Можно добавить расширенную проверку, но пока простая фильтрация
-                    print(f"Отброшен пост {unique_post_id}: город '{city_name}' не найден в тексте")
-                    parsed_posts.add(unique_post_id)
+def city_label(city_name):
+    """
+    Значение метки city для метрик: города вне списка CITIES (введённые пользователями)
+    сводятся в "other", чтобы число рядов не росло без ограничений.
+    """
+    return city_name if city_name in CITIES else "other"
+
+def plan_queries(city_name, current):
+    """
+    Строит список параметров newsfeed.search для города: город + каждое из
+    самых весомых положительных ключевых слов, плюс гео-запрос, если известны координаты.
+    """
+    keywords = sorted(current.positive, key=current.positive.get, reverse=True)[:QUERY_KEYWORDS]
+    queries = [{"q": f"{city_name} {keyword}"} for keyword in keywords]
+    coords = CITY_COORDS.get(city_name)
+    if coords and keywords:
+        queries.append({"q": keywords[0], "latitude": coords[0], "longitude": coords[1]})
+    return queries
+
+def submit_search(params, start_time, end_time, start_from=None):
+    """
+    Ставит запрос страницы newsfeed.search в очередь vk_api.batcher:
+    запросы разных городов и запросов объединяются в execute. Возвращает Future.
+    """
+    params = dict(params, count=COUNT_PER_REQUEST, start_time=start_time, end_time=end_time,
+                  extended=1, fields="city,description")
+    if start_from:
+        params["start_from"] = start_from
+    return vk_api.batcher.submit("newsfeed.search", **params)
+
+class VKSearchSource:
+    """
+    Источник конвейера: страницы newsfeed.search по всем запросам города.
+    Каждый запрос листается своим курсором next_from; страницы всех запросов
+    одной волны уходят в VK вместе, частоту ограничивает vk_api.limiter.
+    Выдаёт списки постов VK (посты гео-запроса помечены by_geo); failed — были ли ошибки запросов.
+    """
+    def __init__(self, city_name, queries, start_time, end_time):
+        self.city_name = city_name
+        self.queries = queries
+        self.start_time = start_time
+        self.end_time = end_time
+        self.failed = False
+        self.cursors = []
+
+    @property
+    def covered_from(self):
+        """
+        Время, начиная с которого выдача всех запросов просмотрена полностью:
+        start_time, если каждый запрос дошёл до начала окна, или дата самого старого
+        поста на последней странице запроса, остановленного лимитом страниц.
+        None, если какой-то запрос не дочитан (ошибка или остановка конвейера).
+        """
+        floors = [cursor["floor"] for cursor in self.cursors]
+        if not floors or None in floors:
+            return None
+        return max(floors)
+
+    def __iter__(self):
+        self.cursors = [{"params": q, "start_from": None, "pages": 0, "floor": None} for q in self.queries]
+        active = list(self.cursors)
+        while active:
+            futures = [
+                (cursor, submit_search(cursor["params"], self.start_time, self.end_time, cursor["start_from"]))
+                for cursor in active
+            ]
+            next_active = []
+            for cursor, future in futures:
+                try:
+                    response = future.result()
+                except vk_api.VKError as e:
+                    print(f"Ошибка VK API ({cursor['params']['q']}): {e.message}")
+                    self.failed = True
+                    continue
+                except Exception as e:
+                    print(f"Ошибка при запросе постов: {e}")
+                    self.failed = True
                     continue
 
-                # Рассчитываем баллы поста
-                score, reasons = calculate_post_score(text)
-
-                if score >= MIN_SCORE_THRESHOLD:
-                    print(f"✅ Пост {unique_post_id} принят. Баллы: {score}. Причины: {reasons}")
-                    # Сохраняем пост (можно добавить город и другую инфу)
-                    add_shelter(unique_post_id, f"Группа {owner_id}", f"https://vk.com/wall{owner_id}_{post_id}", city_name, json.dumps({"date": date, "text": text[:500]}, ensure_ascii=False))
-                    parsed_posts.add(unique_post_id)
-                    total_added += 1
-                    if total_added >= MAX_POSTS:
-                        break
+                items = response.get('items', [])
+                by_geo = "latitude" in cursor["params"]
+                for post in items:
+                    post["by_geo"] = by_geo
+                cursor["start_from"] = response.get("next_from")
+                cursor["pages"] += 1
+                # Останавливаемся, если нет следующей страницы, достигнут лимит
+                # страниц или посты стали старше прошлого запуска
+                oldest = min((post['date'] for post in items), default=0)
+                yield items
+                if not items or not cursor["start_from"] or oldest < self.start_time:
+                    cursor["floor"] = self.start_time
+                elif cursor["pages"] >= MAX_PAGES_PER_QUERY:
+                    cursor["floor"] = oldest
                 else:
-                    print(f"❌ Пост {unique_post_id} отклонён. Баллы: {score}. Причины: {reasons}")
-                    parsed_posts.add(unique_post_id)
+                    next_active.append(cursor)
+            active = next_active
+
+def dedupe_stage(seen, city_name):
+    """
+    Превращает посты VK в записи конвейера и отбрасывает уже обработанные
+    (в том числе найденные в этом запуске другим запросом).
+    """
+    keys = set()
+    def dedupe(items):
+        posts = []
+        for post in items:
+            post_id = post['post_id'] if 'post_id' in post else post['id']
+            owner_id = post['source_id']
+            unique_post_id = f"{owner_id}_{post_id}"
+            if unique_post_id in seen or unique_post_id in keys:
+                print(f"Пропускаем уже обработанный пост {unique_post_id}")
+                continue
+            keys.add(unique_post_id)
+            posts.append({
+                "key": unique_post_id,
+                "owner_id": owner_id,
+                "post_id": post_id,
+                "text": post.get('text', ''),
+                # Сортируемый формат, совместимый с datetime() в SQLite
+                "date": datetime.fromtimestamp(post['date']).strftime("%Y-%m-%d %H:%M:%S"),
+                "city": city_name,
+                "by_geo": post.get("by_geo", False),
+            })
+        if len(items) > len(posts):
+            parser_posts_total.inc(city_label(city_name), "skipped", amount=len(items) - len(posts))
+        return posts
+    return dedupe
+
+def route_stage(seen, city_name):
+    """
+    Оставляет посты, относящиеся к городу: пока простая проверка названия города в тексте.
+    Посты гео-запроса уже найдены по координатам города и не проверяются.
+    """
+    city_lower = city_name.lower()
+    def route(posts):
+        routed = []
+        for post in posts:
+            if not post["by_geo"] and city_lower not in post["text"].lower():
+                print(f"Отброшен пост {post['key']}: город '{city_name}' не найден в тексте")
+                seen.add(post["key"])
+                continue
+            routed.append(post)
+        if len(posts) > len(routed):
+            parser_posts_total.inc(city_label(city_name), "rejected", amount=len(posts) - len(routed))
+        return routed
+    return route
+
+_score_pool = None
+
+def _get_score_pool():
+    global _score_pool
+    if _score_pool is None and SCORE_PROCESSES > 0:
+        _score_pool = ProcessPoolExecutor(max_workers=SCORE_PROCESSES)
+    return _score_pool
+
+def score_stage(seen, city_name):
+    """
+    Оценивает пачку постов целиком (в потоках стадии или в пуле процессов, если
+    задан PIPELINE_SCORE_PROCESSES) и пропускает дальше посты с баллом не ниже порога.
+    """
+    def score(posts):
+        current = rules.get()
+        texts = [post["text"] for post in posts]
+        pool = _get_score_pool()
+        if pool:
+            scores = pool.submit(
+                score_texts, tuple(current.positive.items()), tuple(current.negative.items()),
+                current.stemming, texts,
+            ).result()
+        else:
+            scores = current.scorer.score_batch(texts)
+
+        accepted = []
+        for post, (points, reasons) in zip(posts, scores):
+            if points >= current.min_score:
+                print(f"✅ Пост {post['key']} принят. Баллы: {points}. Причины: {reasons}")
+                post["score"] = points
+                accepted.append(post)
+            else:
+                print(f"❌ Пост {post['key']} отклонён. Баллы: {points}. Причины: {reasons}")
+                seen.add(post["key"])
+        if len(posts) > len(accepted):
+            parser_posts_total.inc(city_label(city_name), "rejected", amount=len(posts) - len(accepted))
+        return accepted
+    return score
+
+def shelter_row(post):
+    """
+    Строка таблицы shelters для принятого поста.
+    """
+    owner_id, post_id = post["owner_id"], post["post_id"]
+    return (post["key"], f"Группа {owner_id}", f"https://vk.com/wall{owner_id}_{post_id}",
+            post["city"], post["text"][:500], post["date"])
+
+def invalidate_rendered(city_name):
+    def after_write(rows):
+        # Сбрасываем готовые списки и карточки, которые показывает бот
+        render_cache.invalidate_city(city_name)
+        render_cache.invalidate_shelters(row[0] for row in rows)
+        # Другие процессы бота сбросят свои кэши по новому поколению
+        render_cache.sync(increment_state(RENDER_GENERATION_KEY), own=True)
+    return after_write
+
+def search_vk_groups(city_name, sink_kind=PIPELINE_SINK):
+    print(f"\n🔍 Начинаем поиск постов для города: {city_name}")
+
+    # Схема нужна и при запуске вне приложения (python vk_parser.py); повторный вызов дешёвый
+    init_db()
+    current = rules.get()
+
+    # Ищем только посты новее прошлого успешного запуска
+    run_started = int(time.time())
+    last_run = get_city_last_run(city_name)
+    if last_run:
+        start_time = last_run - RUN_OVERLAP_SECONDS
+    else:
+        start_time = run_started - FIRST_RUN_DAYS * 86400
 
-            offset += count_per_request
-            time.sleep(0.4)  # API throttle
+    # Ключи, которые могли записать другие воркеры
+    parsed_posts.sync()
 
-        except Exception as e:
-            print(f"Ошибка при запросе постов: {e}")
-            break
+    # source -> dedupe -> route -> score -> sink; принятые посты сохраняются
+    # пачками по мере поступления, поэтому сбой не теряет прогресс
+    source = VKSearchSource(city_name, plan_queries(city_name, current), start_time, run_started)
+    sink, seen = create_sink(parsed_posts, shelter_row, current.max_posts, invalidate_rendered(city_name), sink_kind)
+    pipeline = Pipeline(source, [
+        Stage("dedupe", dedupe_stage(seen, city_name)),
+        Stage("route", route_stage(seen, city_name)),
+        Stage("score", score_stage(seen, city_name), workers=SCORE_WORKERS),
+    ], sink)
+    stats = pipeline.run()
+    stats["source_failed"] = source.failed
+    seen.flush()
 
-    save_cache()
-    print(f"🏁 Поиск завершён. Добавлено постов: {total_added}")
+    parser_posts_total.inc(city_label(city_name), "accepted", amount=sink.written)
+    # Отметка сдвигается, только если всё новее неё действительно обработано.
+    # При достигнутом лимите часть прочитанных постов отброшена конвейером — отметку не трогаем,
+    # следующий запуск перечитает их (сохранённые пропустит parsed_posts)
+    limit_reached = sink.limit is not None and sink.written >= sink.limit
+    covered_from = source.covered_from
+    if not source.failed and not pipeline.errors and not limit_reached and covered_from is not None and sink.name != "dry-run":
+        # Запросы, остановленные лимитом страниц, просмотрены только до covered_from
+        set_city_last_run(city_name, run_started if covered_from <= start_time else covered_from)
+    print(f"🏁 Поиск завершён. Добавлено постов: {sink.written}")
+    return stats
 
 if __name__ == "__main__":
     city = "Москва"  # пример города
-    search_and_filter_posts(city)
+    search_vk_groups(city)
@@ -0,0 +1,118 @@
+import asyncio
+import os
+from collections import OrderedDict, deque
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Сколько ждать места в очереди, прежде чем ответить Telegram ошибкой (он повторит позже)
+ENQUEUE_TIMEOUT = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", "5"))
+# Сколько последних update_id помнить для отсева повторных доставок
+DEDUP_SIZE = 10000
+
+def chat_key(update) -> int:
+    """
+    Ключ очерёдности: обновления одного чата обрабатываются строго по порядку,
+    не более одного одновременно.
+    """
+    if update.message:
+        return update.message.chat.id
+    if update.edited_message:
+        return update.edited_message.chat.id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+    return update.update_id
+
+class UpdateQueue:
+    """
+    Очередь входящих обновлений Telegram: webhook сразу подтверждает получение,
+    а пул воркеров обрабатывает обновления в фоне.
+    У каждого чата своя очередь обновлений, а в общей очереди ready стоят чаты, готовые
+    к обработке. Воркер берёт чат, обрабатывает одно его обновление и возвращает чат
+    в конец ready, если там есть ещё. Порядок внутри чата сохраняется, а медленный
+    чат занимает только один воркер. Всего в обработке не больше maxsize обновлений.
+    """
+    def __init__(self, handler, workers: int = WEBHOOK_WORKERS, maxsize: int = WEBHOOK_QUEUE_SIZE,
+                 claim=None, unclaim=None):
+        self.handler = handler
+        # Общий для всех процессов отсев повторов: claim(update_id) -> False, если обновление
+        # уже принял другой воркер; unclaim снимает отметку, если поставить в очередь не удалось
+        self.claim = claim
+        self.unclaim = unclaim
+        self.workers = workers
+        self.slots = asyncio.Semaphore(maxsize)
+        self.ready = asyncio.Queue()
+        # ключ чата -> обновления чата в порядке поступления
+        self.chats = {}
+        self.pending = 0
+        self.tasks = []
+        self.seen = OrderedDict()
+
+    def depth(self) -> int:
+        return self.pending
+
+    def is_duplicate(self, update_id: int) -> bool:
+        return update_id in self.seen
+
+    def mark_seen(self, update_id: int):
+        self.seen[update_id] = None
+        while len(self.seen) > DEDUP_SIZE:
+            self.seen.popitem(last=False)
+
+    async def submit(self, update) -> bool:
+        """
+        Ставит обновление в очередь. Повторы по update_id отбрасываются.
+        Если очередь переполнена дольше ENQUEUE_TIMEOUT, возвращает False.
+        """
+        if self.is_duplicate(update.update_id):
+            return True
+        if self.claim and not await self.claim(update.update_id):
+            self.mark_seen(update.update_id)
+            return True
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout=ENQUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if self.unclaim:
+                await self.unclaim(update.update_id)
+            return False
+        key = chat_key(update)
+        chat = self.chats.get(key)
+        if chat is None:
+            # Чат не обрабатывается и не ждёт в ready — ставим его в очередь
+            chat = self.chats[key] = deque()
+            self.ready.put_nowait(key)
+        chat.append(update)
+        self.pending += 1
+        self.mark_seen(update.update_id)
+        return True
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Дорабатываем уже принятые обновления, затем останавливаем воркеры
+        await self.ready.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _worker(self):
+        while True:
+            key = await self.ready.get()
+            chat = self.chats[key]
+            update = chat[0]
+            try:
+                await self.handler(update)
+            except Exception as e:
+                print(f"[!] Ошибка обработки update {update.update_id}: {e}")
+            finally:
+                chat.popleft()
+                self.pending -= 1
+                self.slots.release()
+                if chat:
+                    # Следующее обновление чата — после уже ожидающих чатов
+                    self.ready.put_nowait(key)
+                else:
+                    del self.chats[key]
+                self.ready.task_done()